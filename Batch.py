@@ -0,0 +1,256 @@
+import sys
+
+import numpy as np
+
+import Cache
+import Simulator
+import Sweep
+import Trace
+
+# Wider caches, and batches of fewer caches, run faster one by one with Cache.access
+BATCH_WAYS = 8
+MIN_BATCH_SIZE = 8
+
+INVALID_TAG = -1
+PADDING_TAG = -2
+PADDING_STAMP = np.iinfo(np.int64).max
+
+
+class CacheBatch:
+    """
+    The state of several L1 caches with the same block size, stacked so that one access is applied
+    to all of them with a handful of numpy operations instead of one Cache.access per cache.
+    The sets of every cache are rows of (rows, width) arrays. Caches with fewer ways than the width
+    are padded with ways that never hit and are never chosen as victims.
+    The caches may mix replacement policies: each one takes the victim of its own policy.
+    """
+
+    def __init__(self, caches, width, count):
+        """
+        :param caches: Freshly built L1 Cache objects, whose state is filled in by store()
+        :param width: Number of ways of the batch, at least the associativity of every cache
+        :param count: Length of the trace, needed by the Optimal policy's next-use values
+        """
+        self.caches = caches
+        self.width = width
+        self.count = count
+        sets = [cache.num_of_sets for cache in caches]
+        assocs = np.array([cache.associativity for cache in caches], dtype=np.int64)
+        policies = np.array([cache.replacement_policy for cache in caches])
+        self.offset_bits = caches[0].number_of_offset_bits
+        self.index_masks = np.array([cache.index_mask for cache in caches], dtype=np.int64)
+        self.index_bits = np.array([cache.number_of_index_bits for cache in caches], dtype=np.int64)
+        self.row_bases = np.cumsum([0] + sets[:-1]).astype(np.int64)
+
+        rows = sum(sets)
+        padding = np.arange(width) >= np.repeat(assocs, sets)[:, None]
+        self.tags = np.full((rows, width), INVALID_TAG, dtype=np.int64)
+        self.tags[padding] = PADDING_TAG
+        self.dirty_bits = np.zeros((rows, width), dtype=bool)
+        self.stamps = np.full((rows, width), -1, dtype=np.int64)  # invalid ways are the least recently used
+        self.stamps[padding] = PADDING_STAMP
+        self.block_addresses = np.zeros((rows, width), dtype=np.uint32)
+
+        self.is_opt = policies == 2
+        self.has_opt = bool(self.is_opt.any())
+        if self.has_opt:
+            # invalid ways are filled first, before blocks that are never used again (next use == count)
+            self.next_uses = np.full((rows, width), count + 1, dtype=np.int64)
+            self.next_uses[padding] = -1
+
+        self.is_plru = policies == 1
+        self.has_plru = bool(self.is_plru.any())
+        if self.has_plru:
+            self.plru_bits = np.zeros(rows, dtype=np.int64)
+            self.last_internal_nodes = assocs - 1
+            # the deepest leaf, ceil(log2(ways)) nodes down, also when the ways are not a power of two
+            self.plru_depth = int(assocs[self.is_plru].max() - 1).bit_length()
+            self.and_masks = np.full((len(caches), width), -1, dtype=np.int64)
+            self.or_masks = np.zeros((len(caches), width), dtype=np.int64)
+            for i, cache in enumerate(caches):
+                for way, (and_mask, or_mask) in enumerate(cache.plru_masks):
+                    self.and_masks[i, way] = and_mask
+                    self.or_masks[i, way] = or_mask
+
+    def run(self, ops, addresses, start, next_use=None):
+        """
+        Applies a chunk of references to every cache of the batch.
+        :param start: Trace position of the first reference of the chunk
+        :param next_use: Next-use values of the chunk, needed when the batch holds Optimal caches
+        :return: hits and dirty victims as (len(addresses), caches) bool arrays. A miss whose
+                 victim was dirty issues a writeback.
+        """
+        width = self.width
+        count = len(self.caches)
+        blocks = np.asarray(addresses, dtype=np.int64) >> self.offset_bits
+        rows = (blocks[:, None] & self.index_masks) + self.row_bases
+        row_slots = rows * width
+        tags = blocks[:, None] >> self.index_bits
+        hits = np.ones(rows.shape, dtype=bool)
+        dirty_victims = np.zeros(rows.shape, dtype=bool)
+        cache_offsets = np.arange(count) * width
+
+        tags_2d, stamps_2d = self.tags, self.stamps
+        all_tags, all_stamps = tags_2d.reshape(-1), stamps_2d.reshape(-1)
+        all_dirty_bits, all_block_addresses = self.dirty_bits.reshape(-1), self.block_addresses.reshape(-1)
+        if self.has_opt:
+            next_uses_2d = self.next_uses
+            all_next_uses = next_uses_2d.reshape(-1)
+            next_use = next_use.tolist()
+        if self.has_plru:
+            plru_bits, last_internal_nodes = self.plru_bits, self.last_internal_nodes
+            all_and_masks, all_or_masks = self.and_masks.reshape(-1), self.or_masks.reshape(-1)
+
+        for t, (op, address) in enumerate(zip(ops.tolist(), addresses.tolist())):
+            row, tag = rows[t], tags[t]
+            match = tags_2d[row] == tag[:, None]
+            way = match.argmax(1)
+            if np.count_nonzero(match) == count:
+                # every cache hits, which is the common case: only the recency state changes
+                slot = row_slots[t] + way
+                if self.has_plru:
+                    mask_slot = cache_offsets + way
+                    plru_bits[row] = plru_bits[row] & all_and_masks[mask_slot] | all_or_masks[mask_slot]
+            else:
+                hit = match.any(1)
+                victim = stamps_2d[row].argmin(1)
+                if self.has_opt:
+                    victim = np.where(self.is_opt, next_uses_2d[row].argmax(1), victim)
+                if self.has_plru:
+                    bits = plru_bits[row]
+                    node = np.zeros_like(bits)
+                    walked_bits = bits
+                    for _ in range(self.plru_depth):
+                        # flip every bit on the way down and move away from the recently used side
+                        internal = node < last_internal_nodes
+                        bit = walked_bits >> node & 1
+                        walked_bits = np.where(internal, walked_bits ^ (1 << node), walked_bits)
+                        node = np.where(internal, 2 * node + 2 - bit, node)
+                    victim = np.where(self.is_plru, node - last_internal_nodes, victim)
+                way = np.where(hit, way, victim)
+                slot = row_slots[t] + way
+                dirty = all_dirty_bits[slot]
+                hits[t] = hit
+                dirty_victims[t] = dirty & ~hit
+                all_tags[slot] = tag
+                all_block_addresses[slot] = np.where(hit, all_block_addresses[slot], address)
+                if op != Trace.OP_WRITE:
+                    all_dirty_bits[slot] = dirty & hit
+                if self.has_plru:
+                    mask_slot = cache_offsets + way
+                    plru_bits[row] = np.where(hit, bits & all_and_masks[mask_slot] | all_or_masks[mask_slot],
+                                              walked_bits)
+            all_stamps[slot] = start + t
+            if op == Trace.OP_WRITE:
+                all_dirty_bits[slot] = True
+            if self.has_opt:
+                all_next_uses[slot] = next_use[t]
+        return hits, dirty_victims
+
+    def store(self):
+        """
+        Copies the final state of every cache of the batch into its Cache object, so that it can
+        be displayed or simulated further exactly as if it had run the trace itself.
+        :return: NONE
+        """
+        for cache, row_base in zip(self.caches, self.row_bases.tolist()):
+            rows = slice(row_base, row_base + cache.num_of_sets)
+            ways = slice(0, cache.associativity)
+            tags = self.tags[rows, ways]
+            stamps = self.stamps[rows, ways]
+            valid = tags != INVALID_TAG
+            state = cache.get_state_arrays()
+            state['tags'][:] = np.where(valid, tags, 0)
+            state['valid_bits'][:] = valid
+            state['dirty_bits'][:] = self.dirty_bits[rows, ways]
+            state['stamps'][:] = stamps
+            state['block_addresses'][:] = self.block_addresses[rows, ways]
+            if cache.replacement_policy == 2:
+                state['next_uses'][:] = np.where(valid, self.next_uses[rows, ways], -1)
+            if cache.replacement_policy == 1:
+                cache.set_plru_bits(self.plru_bits[rows].tolist())
+            cache.rebuild_lookup()
+            if self.count:
+                cache.timestamp = self.count - 1
+
+
+def run_batch(trace, configs, min_batch_size=MIN_BATCH_SIZE, verbose=False, contents=False):
+    """
+    Simulates many L1-only configurations in lockstep over a single walk of the trace.
+    Caches with the same block size and at most BATCH_WAYS ways form one batch. Configurations
+    with an L2, wider L1s or a fully-associative PLRU L1, and batches of fewer than min_batch_size
+    caches, are simulated one by one with Sweep.run_sweep instead.
+    :param trace: A Trace or the path of a text or packed trace file
+    :param configs: Configurations as accepted by Sweep.run_sweep
+    :param contents: Keep the final cache contents in each result, see Sweep.collect_results
+    :return: A list of result dicts with the same measurements as Sweep.run_config, in the order of configs
+    """
+    if not isinstance(trace, Trace.Trace):
+        trace = Trace.read_trace(trace)
+    configs = [Sweep.SweepConfig(*config) for config in configs]
+
+    groups = {}
+    single = []
+    for position, config in enumerate(configs):
+        if config.l2size or config.l1assoc > BATCH_WAYS or \
+                Cache.cache_class(config.rep_pol, config.l1size, config.l1assoc, config.blocksize) \
+                is Cache.FullyAssociativePLRUCache:  # no tree masks to stack
+            single.append(position)
+        else:
+            groups.setdefault(config.blocksize, []).append(position)
+    hierarchies = {}
+    batches = []
+    for blocksize, positions in groups.items():
+        if len(positions) < min_batch_size:
+            single.extend(positions)
+            continue
+        for position in positions:
+            hierarchies[position] = Simulator.build_hierarchy(configs[position])
+        width = max(configs[position].l1assoc for position in positions)
+        batch = CacheBatch([hierarchies[position][0] for position in positions], width, len(trace))
+        next_use = trace.next_use(blocksize) if batch.has_opt else None
+        batches.append((positions, batch, next_use, np.zeros((2, len(positions)), dtype=np.int64),
+                        np.zeros(len(positions), dtype=np.int64)))
+
+    results = [None] * len(configs)
+    single.sort()
+    for position, result in zip(single, Sweep.run_sweep(trace, [configs[position] for position in single],
+                                                          contents=contents)):
+        results[position] = result
+
+    reads = writes = 0
+    start = 0
+    for ops, addresses in trace.chunks():
+        stop = start + len(addresses)
+        is_write = np.asarray(ops) == Trace.OP_WRITE
+        writes += int(is_write.sum())
+        reads += len(addresses) - int(is_write.sum())
+        for positions, batch, next_use, misses, writebacks in batches:
+            chunk_next_use = next_use[start:stop] if next_use is not None else None
+            hits, dirty_victims = batch.run(ops, addresses, start, chunk_next_use)
+            misses[0] += (~hits[~is_write]).sum(0)
+            misses[1] += (~hits[is_write]).sum(0)
+            writebacks += dirty_victims.sum(0)
+        start = stop
+
+    for positions, batch, next_use, misses, writebacks in batches:
+        batch.store()
+        for i, position in enumerate(positions):
+            l1_cache, l2_cache = hierarchies[position]
+            l1_cache.measurements['reads'] = reads
+            l1_cache.measurements['reads_miss'] = int(misses[0, i])
+            l1_cache.measurements['writes'] = writes
+            l1_cache.measurements['writes_miss'] = int(misses[1, i])
+            l1_cache.measurements['num_writebacks'] = int(writebacks[i])
+            results[position] = Sweep.collect_results(configs[position], l1_cache, l2_cache, contents)
+    if verbose:
+        for result in results:
+            print(result['config'], "L1 miss rate:", result['l1']['miss_rate'])
+    return results
+
+
+if __name__ == "__main__":
+    # python Batch.py <trace_file>
+    # Runs the L1 grid of Sweep.py in lockstep batches and prints the miss rates
+    for batch_result in run_batch(sys.argv[1], Sweep.l1_grid()):
+        print(*batch_result['config'], batch_result['l1']['miss_rate'])
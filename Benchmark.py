@@ -0,0 +1,270 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import Batch
+import Simulator
+import StackDistance
+import Sweep
+import Trace
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TRACES = os.path.join(ROOT, "Traces", "*_trace.txt")
+VALIDATIONS = os.path.join(ROOT, "Validation run", "validation*.txt")
+
+# The hierarchy of the validation runs with an L2, simulated under every policy and inclusion property
+BLOCKSIZE, L1_SIZE, L1_ASSOC, L2_SIZE, L2_ASSOC = 16, 1024, 2, 8192, 4
+POLICIES = ("LRU", "Pseudo-LRU", "Optimal")
+INCLUSIONS = ("non-inclusive", "inclusive")
+
+DEFAULT_OUTPUT = "benchmark.json"
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.2
+
+# Grid points of Graphs.py checked against Simulator.simulate: (blocksize, l1size, l1assoc) caches
+# for the stack distance curves, whose "full" points have size / 32 ways, and 4-way caches of every
+# policy for the lockstep batches, batched together with caches whose PLRU trees are not complete
+STACK_DISTANCE_POINTS = ((32, 1024, 1), (32, 4096, 4), (32, 16384, 8), (32, 2048, 64), (32, 8192, 256))
+BATCH_SIZES = (1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144)
+BATCH_ODD_WAYS = (3, 5, 6, 7)
+BATCH_ODD_SETS = 32
+
+
+def peak_rss_kb():
+    """
+    :return: The peak resident set size of this process in KiB, or None where it cannot be measured
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # macOS reports bytes, Linux KiB
+
+
+def run_case(trace_file, config):
+    """
+    Simulates one configuration with Simulator.simulate, as main.py does, and times it. Runs in its own process,
+    so that the peak RSS is that of this case alone.
+    :return: A dict of the timings, peak RSS and measurements of the run
+    """
+    start = time.perf_counter()
+    trace = Trace.read_trace(trace_file)
+    loaded = time.perf_counter()
+    result = Simulator.simulate(config, trace)
+    done = time.perf_counter()
+    return {
+        "accesses": len(trace),
+        "load_time": loaded - start,
+        "simulation_time": done - loaded,
+        "wall_time": done - start,
+        "accesses_per_sec": len(trace) / (done - loaded),
+        "peak_rss_kb": peak_rss_kb(),
+        "l1": result.l1_cache.measurements,
+        "l2": result.l2_cache.measurements,
+    }
+
+
+def benchmark_case(trace_file, config, repeat=1):
+    """
+    Runs a case in a fresh interpreter, repeat times, and keeps the fastest run.
+    :return: The dict of run_case with the trace and config added
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--case", trace_file] + [str(x) for x in config]
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        runs.append(json.loads(output))
+    case = min(runs, key=lambda run: run["simulation_time"])
+    case["peak_rss_kb"] = max((run["peak_rss_kb"] for run in runs if run["peak_rss_kb"] is not None), default=None)
+    case["trace"] = os.path.basename(trace_file)
+    case["config"] = dict(Sweep.SweepConfig(*config)._asdict())
+    return case
+
+
+def parse_output(text):
+    """
+    Parses the report of main.printResults, or an expected output in Validation run/, which has
+    the same fields with different spacing.
+    The blocks of a set are kept in way order, except under Pseudo-LRU, where they are kept as a
+    sorted list since the way its tree fills first is not part of the result.
+    :return: A dict of the configuration fields, the contents of each level and the raw results
+    """
+    parsed = {"configuration": {}, "contents": {}, "results": {}}
+    section = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("====="):
+            section = line.strip("= ")
+            continue
+        if not line:
+            continue
+        if section == "Simulator configuration":
+            name, value = line.split(":", 1)
+            parsed["configuration"][name.strip()] = value.strip()
+        elif section is not None and section.endswith("contents"):
+            name, blocks = line.split(":", 1)
+            tokens = blocks.split()
+            entries = []
+            for token in tokens:
+                if token == "D" and entries:
+                    entries[-1] += " D"
+                else:
+                    entries.append(token)
+            if parsed["configuration"].get("REPLACEMENT POLICY") == "Pseudo-LRU":
+                entries.sort()
+            parsed["contents"].setdefault(section, {})[" ".join(name.split())] = entries
+        elif section == "Simulation results (raw)":
+            name, value = line.split(":", 1)
+            parsed["results"][name.split(".")[0]] = value.strip()
+    return parsed
+
+
+def validation_command(configuration):
+    """
+    :return: The main.py arguments that reproduce the configuration block of a validation file
+    """
+    policy = POLICIES.index(configuration["REPLACEMENT POLICY"])
+    inclusion = INCLUSIONS.index(configuration["INCLUSION PROPERTY"])
+    return [configuration["BLOCKSIZE"], configuration["L1_SIZE"], configuration["L1_ASSOC"],
+            configuration["L2_SIZE"], configuration["L2_ASSOC"], str(policy), str(inclusion),
+            os.path.join(ROOT, "Traces", configuration["trace_file"])]
+
+
+def validate(validation_file):
+    """
+    Runs main.py on the configuration of a validation file and compares its report with the file.
+    :return: A dict naming the file and listing the fields that differ, empty when the run matches
+    """
+    with open(validation_file, encoding="utf-8-sig") as f:
+        expected = parse_output(f.read())
+    command = [sys.executable, os.path.join(ROOT, "main.py")] + validation_command(expected["configuration"])
+    actual = parse_output(subprocess.run(command, check=True, stdout=subprocess.PIPE,
+                                         universal_newlines=True).stdout)
+    differences = []
+    for part in ("configuration", "results"):
+        for name, value in expected[part].items():
+            if actual[part].get(name) != value:
+                differences.append("{} {}: expected {}, got {}".format(part, name, value, actual[part].get(name)))
+    for level, sets in expected["contents"].items():
+        for name, blocks in sets.items():
+            if actual["contents"].get(level, {}).get(name) != blocks:
+                differences.append("{} {} differs".format(level, name))
+    return {"file": os.path.basename(validation_file), "differences": differences}
+
+
+def check_fast_paths(trace_file):
+    """
+    Compares the miss rates that Graphs.py takes from StackDistance and Batch.run_batch with those
+    of Simulator.simulate, on a few grid points.
+    :return: A list of messages, one per grid point whose miss rate differs
+    """
+    trace = Trace.read_trace(trace_file)
+    checks = [("LRU stack distances", 0, StackDistance.lru_miss_rates(trace, STACK_DISTANCE_POINTS)),
+              ("Optimal stack distances", 2, StackDistance.opt_miss_rates(trace, STACK_DISTANCE_POINTS))]
+    messages = []
+    for name, rep_pol, miss_rates in checks:
+        for (blocksize, l1size, l1assoc), miss_rate in zip(STACK_DISTANCE_POINTS, miss_rates):
+            config = Sweep.SweepConfig(blocksize, l1size, l1assoc, 0, 0, rep_pol, 0)
+            expected = Simulator.simulate(config, trace).l1_cache.measurements['miss_rate']
+            if miss_rate != expected:
+                messages.append("{} {}: miss rate {}, simulated {}".format(name, tuple(config), miss_rate, expected))
+    configs = [(32, size, 4, 0, 0, rep_pol, 0) for rep_pol in range(len(POLICIES)) for size in BATCH_SIZES]
+    configs += [(32, 32 * ways * BATCH_ODD_SETS, ways, 0, 0, rep_pol, 0)
+                for rep_pol in range(len(POLICIES)) for ways in BATCH_ODD_WAYS]
+    for result in Batch.run_batch(trace, configs):
+        expected = Simulator.simulate(result['config'], trace).l1_cache.measurements['miss_rate']
+        if result['l1']['miss_rate'] != expected:
+            messages.append("Batch.run_batch {}: miss rate {}, simulated {}".format(
+                tuple(result['config']), result['l1']['miss_rate'], expected))
+    return messages
+
+
+def regressions(cases, baseline, tolerance):
+    """
+    Compares the throughput of every case with the same case in a baseline report.
+    :return: A list of messages, one per case slower than the baseline by more than the tolerance
+    """
+    previous = {(case["trace"], tuple(case["config"].values())): case for case in baseline["cases"]}
+    messages = []
+    for case in cases:
+        old = previous.get((case["trace"], tuple(case["config"].values())))
+        if old is not None and case["accesses_per_sec"] < old["accesses_per_sec"] * (1 - tolerance):
+            messages.append("{} {}: {:.0f} accesses/s, baseline {:.0f}".format(
+                case["trace"], tuple(case["config"].values()), case["accesses_per_sec"], old["accesses_per_sec"]))
+    return messages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks and validates the cache simulator.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON report to write")
+    parser.add_argument("--baseline", help="an earlier JSON report to check throughput against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed relative throughput drop against the baseline")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs per case, the fastest is kept")
+    parser.add_argument("--traces", nargs="+", default=sorted(glob.glob(TRACES)), help="trace files to run")
+    parser.add_argument("--case", nargs=8, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        print(json.dumps(run_case(args.case[0], Sweep.SweepConfig(*(int(x) for x in args.case[1:])))))
+        return 0
+
+    cases = []
+    print("{:<20} {:<11} {:<14} {:>12} {:>9} {:>10}".format("trace", "policy", "inclusion", "accesses/s",
+                                                            "wall (s)", "RSS (KiB)"))
+    for trace_file in args.traces:
+        for rep_pol, policy in enumerate(POLICIES):
+            for inc_pol, inclusion in enumerate(INCLUSIONS):
+                config = (BLOCKSIZE, L1_SIZE, L1_ASSOC, L2_SIZE, L2_ASSOC, rep_pol, inc_pol)
+                case = benchmark_case(trace_file, config, args.repeat)
+                cases.append(case)
+                print("{:<20} {:<11} {:<14} {:>12.0f} {:>9.3f} {:>10}".format(
+                    case["trace"], policy, inclusion, case["accesses_per_sec"], case["wall_time"],
+                    case["peak_rss_kb"]))
+
+    validations = [validate(validation_file) for validation_file in sorted(glob.glob(VALIDATIONS))]
+    for validation in validations:
+        print(validation["file"], "OK" if not validation["differences"] else "MISMATCH")
+        for difference in validation["differences"]:
+            print("   ", difference)
+
+    fast_path_mismatches = check_fast_paths(args.traces[0]) if args.traces else []
+    print("fast paths", "OK" if not fast_path_mismatches else "MISMATCH")
+    for message in fast_path_mismatches:
+        print("   ", message)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cases": cases,
+        "validations": validations,
+        "fast_paths": fast_path_mismatches,
+    }
+    failures = [validation["file"] for validation in validations if validation["differences"]]
+    failures += fast_path_mismatches
+    if args.baseline:
+        with open(args.baseline) as f:
+            slow = regressions(cases, json.load(f), args.tolerance)
+        report["regressions"] = slow
+        for message in slow:
+            print("Throughput regression:", message)
+        failures += slow
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Report written to", args.output)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    # python Benchmark.py [--output benchmark.json] [--baseline old.json] [--tolerance 0.2] [--repeat 3]
+    sys.exit(main())
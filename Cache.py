@@ -1,10 +1,53 @@
+import array
+import functools
+import heapq
 import math
-import Block
-import Node
+from collections import OrderedDict
+
+import numpy as np
+
+
+def format_tag(tag):
+    """
+    Tags are kept as integers and only turned into hex for display. Empty blocks display nothing.
+    """
+    return "" if tag is None else format(tag, 'x')
+
+
+def decode_addresses(addresses, number_of_offset_bits, number_of_index_bits):
+    """
+    Splits a column of 32 bit addresses into set indices and integer tags with shifts and masks.
+    :return: index array and tag array of the addresses
+    """
+    addresses = np.asarray(addresses, dtype=np.uint32)
+    index = (addresses >> number_of_offset_bits) & ((1 << number_of_index_bits) - 1)
+    tag = addresses >> (number_of_offset_bits + number_of_index_bits)
+    return index, tag
+
+
+# The (status, victim) results of Cache.read/write that evict nothing
+HIT = (0, None)
+FILL = (1, None)
+
+
+class LazySets(dict):
+    """
+    Per-set structures, keyed by set index and created by factory() on the first access to their set,
+    so that building a cache costs nothing per set and the sets a trace never touches cost no memory.
+    """
+
+    def __init__(self, factory):
+        super(LazySets, self).__init__()
+        self.factory = factory
+
+    def __missing__(self, index):
+        value = self[index] = self.factory()
+        return value
 
 
 class Cache:
-    def __init__(self, size, associativity, block_size, inclusion_property, replacement_policy, is_highest):
+    def __init__(self, size, associativity, block_size, inclusion_property, replacement_policy, is_highest,
+                 name=None, track_next_uses=False):
         self.associativity = associativity
         self.size = size
         self.block_size = block_size
@@ -12,12 +55,25 @@ class Cache:
         self.number_of_tag_bits = 0
         self.number_of_index_bits = 0
         self.number_of_offset_bits = 0
-        self.block_container = []
+        self.index_mask = 0
+        # Cache line state, one entry per (set, way) at position set * associativity + way
+        self.tags = array.array('q')
+        self.valid_bits = bytearray()
+        self.dirty_bits = bytearray()
+        self.stamps = array.array('q')
+        self.block_addresses = array.array('I')
+        self.next_uses = array.array('q')
+        self.lookup_table = LazySets(OrderedDict)
+        self.free_ways = LazySets(list)
         self.timestamp = -math.inf
         self.inclusion_property = inclusion_property
         self.replacement_policy = replacement_policy
-        self.future_table = {}
-        self.plru_trees = {}
+        # The Optimal policy needs the next use of its blocks, and so does any cache that writes back
+        # into an Optimal cache below it
+        self.track_next_uses = track_next_uses or replacement_policy == 2
+        self.opt_heaps = LazySets(list)
+        self.plru_bits = []
+        self.plru_masks = []
         self.measurements = {
             "reads": 0,
             "reads_miss": 0,
@@ -28,80 +84,88 @@ class Cache:
             "memory_traffic": 0,
             "direct_writeback": 0
         }
-        self.is_write_back = False
-        self.write_back_inst = ""
-        self.is_issue_invalidate = False
-        self.invalidate_inst = ""
         self.is_highest_level = is_highest
+        self.name = name or ("L1" if is_highest else "L2")
         if self.size:
             self.build_cache()
 
     def build_cache(self):
         """
-        Builds the cache container by initializing the required number of blocks.
-        The number of block will be given by get_dimensions() method.
-        The container will contain 'num_of_sets' rows and 'associativity' columns,
-        where each cell will hold an object of the class Block.
-        :return: A m * n matrix where, m = num_of_sets and n = associativity
+        Builds the cache state. The number of blocks will be given by get_dimensions() method.
+        The state is a set of flat columns of 'num_of_sets' * 'associativity' entries: the integer tag,
+        valid and dirty bits, LRU stamp (-1 when never used), original block address and, for the
+        Optimal policy, next use (-1 when unknown) of every block. get_state_arrays() gives
+        them as m * n arrays.
+        Each set also gets a lookup table mapping tag -> way, kept in recency order (least recently
+        used first), and a min-heap of its free ways so that fills take the lowest empty way.
+        These are only created when their set is first accessed (see LazySets).
+        :return: NONE
         """
         self.get_dimensions()  # get dimensions
-        for i in range(self.num_of_sets):
-            i_set = []
-            if self.replacement_policy == 1:
-                # create Trees here
-                height = int(math.log(self.associativity, 2))
-                i_set.append(self.createTree(height))
-            else:
-                for j in range(self.associativity):
-                    block = Block.Block()
-                    i_set.append(block)
-            self.block_container.append(i_set)
-
-    def read(self, instruction):
+        lines = self.num_of_sets * self.associativity
+        self.tags = array.array('q', bytes(8 * lines))
+        self.valid_bits = bytearray(lines)
+        self.dirty_bits = bytearray(lines)
+        self.stamps = array.array('q', [-1]) * lines
+        self.block_addresses = array.array('I', bytes(4 * lines))
+        self.free_ways = LazySets(functools.partial(list, range(self.associativity)))
+        if self.track_next_uses:
+            self.next_uses = array.array('q', [-1]) * lines
+        if self.replacement_policy == 1:
+            self.plru_bits = [0] * self.num_of_sets
+            self.plru_masks = self.build_plru_masks()
+
+    def read(self, instruction, index, tag):
         """
         Reads the instruction tag in the set of cache given by the index of the instruction.
-        The index and tag will be determined by making a call to the method get_instruction_components.
+        The index and tag are the components of the instruction given by get_instruction_components.
         :return: An integer flag which will indicate whether the read operation resulted
-        in a hit, a miss or a miss-replace. (0, 1, 2 respectively)
+        in a hit, a miss or a miss-replace (0, 1, 2 respectively), and the victim (see evict)
         """
-        index, tag = self.get_instruction_components(instruction)
-        for block in self.block_container[index]:
-            if block.tag == tag:
-                block.time = self.timestamp
-                return 0
-            elif block.tag == "":
-                block.tag = tag
-                block.instruction = instruction
-                block.time = self.timestamp
-                block.isValid = True
-                return 1
-            else:
-                pass
-        self.evict(index, tag, 'r', instruction)
-        return 2
-
-    def write(self, instruction):
+        lookup = self.lookup_table[index]
+        way = lookup.get(tag)
+        if way is not None:
+            lookup.move_to_end(tag)
+            self.stamps[index * self.associativity + way] = self.timestamp
+            return HIT
+        free_ways = self.free_ways[index]
+        if free_ways:
+            way = heapq.heappop(free_ways)
+            lookup[tag] = way
+            slot = index * self.associativity + way
+            self.tags[slot] = tag
+            self.block_addresses[slot] = instruction
+            self.stamps[slot] = self.timestamp
+            self.valid_bits[slot] = 1
+            return FILL
+        return 2, self.evict(index, tag, 'r', instruction)
+
+    def write(self, instruction, index, tag):
         """
         Writes the instruction tag to the block in a set of cache given by the index of the instruction.
-        The index and tag will be determined by making a call to the method get_instruction_components.
-        :return: A boolean flag which will indicate whether the write operation resulted in a hit or a miss.
+        The index and tag are the components of the instruction given by get_instruction_components.
+        :return: The status of the write, as for read, and the victim (see evict)
         """
-        index, tag = self.get_instruction_components(instruction)
-        for block in self.block_container[index]:
-            if block.tag == tag:
-                block.isDirty = True
-                block.time = self.timestamp
-                return 0
-            elif block.tag == "":
-                block.tag = tag
-                block.instruction = instruction
-                block.isDirty = True
-                block.time = self.timestamp
-                return 1
-            else:
-                pass
-        self.evict(index, tag, 'w', instruction)  # the isDirty flag of evicted block should be set to false
-        return 2
+        lookup = self.lookup_table[index]
+        way = lookup.get(tag)
+        if way is not None:
+            lookup.move_to_end(tag)
+            slot = index * self.associativity + way
+            self.dirty_bits[slot] = 1
+            self.stamps[slot] = self.timestamp
+            return HIT
+        free_ways = self.free_ways[index]
+        if free_ways:
+            way = heapq.heappop(free_ways)
+            lookup[tag] = way
+            slot = index * self.associativity + way
+            self.tags[slot] = tag
+            self.block_addresses[slot] = instruction
+            self.dirty_bits[slot] = 1
+            self.stamps[slot] = self.timestamp
+            self.valid_bits[slot] = 1
+            return FILL
+        return 2, self.evict(index, tag, 'w', instruction)
 
     def evict(self, index, tag, mode, instruction):
         """
@@ -109,74 +173,80 @@ class Cache:
         In case of a miss and replace, this method will determine the block to be evicted
         following the replacement policy provided to the cache.
         0 for LRU, 1 for Pseudo-LRU, 2 for Optimal.
-        :return: NONE
+        :return: The victim, a (block address, is dirty, next use) tuple of the block that was replaced,
+        or None when the replaced way was empty. The next use is only known under the Optimal policy.
         """
-        block_set = self.block_container[index]
         if self.replacement_policy == 0:
-            self.evictLRU(block_set, tag, self.timestamp, mode, instruction)
+            return self.evictLRU(index, tag, self.timestamp, mode, instruction)
         elif self.replacement_policy == 1:
-            self.evictPLRU(block_set, tag, self.timestamp, mode)
+            return self.updateTree(index, tag, mode, instruction)
         else:
-            self.evictOPT(block_set, tag, self.timestamp, mode, index, instruction)
+            return self.evictOPT(index, tag, self.timestamp, mode, instruction)
 
-    def execute(self, instruction):
+    def access(self, write, address, index=None, tag=None, next_use=None):
         """
-        Executes a read/write as specified in the instruction
-        and performs a counter update. Updates the value to the 'timestamp'
-        :return: Status of the read/write operation
-        0 - hit, 1 miss, 2 miss-replace
+        Reads or writes the block holding an address and performs a counter update.
+        Updates the value to the 'timestamp'.
+        The index and tag may be passed in when they were precomputed by decode_addresses,
+        otherwise they are derived from the address.
+        For the Optimal policy, next_use is the trace position at which the accessed block
+        is referenced next (see Trace.next_use).
+        Nothing is sent to other caches: the replaced block is returned for the caller to write back
+        or back-invalidate (see Hierarchy).
+        :return: Status of the read/write operation (0 - hit, 1 miss, 2 miss-replace)
+        and the victim of the access, see evict
         """
         if self.timestamp < 0:
             self.timestamp = 0
         else:
             self.timestamp += 1
 
-        self.is_write_back = False
-        self.write_back_inst = ""
-
-        index, tag = self.get_instruction_components(instruction[1])
-        if instruction[0] == 'r':
-            status = self.read(instruction[1])
-            self.measurements['reads'] += 1
-            if status == 0:
-                pass
-            elif status == 1:
-                self.measurements['reads_miss'] += 1
-            else:
-                self.measurements['reads_miss'] += 1
-        else:
-            status = self.write(instruction[1])
+        if index is None:
+            index, tag = self.get_instruction_components(address)
+        if write:
+            status, victim = self.write(address, index, tag)
             self.measurements['writes'] += 1
-            if status == 0:
-                pass
-            elif status == 1:
-                self.measurements['writes_miss'] += 1
-            else:
+            if status:
                 self.measurements['writes_miss'] += 1
+        else:
+            status, victim = self.read(address, index, tag)
+            self.measurements['reads'] += 1
+            if status:
+                self.measurements['reads_miss'] += 1
+        if victim is not None and victim[1]:
+            self.measurements['num_writebacks'] += 1  # the dirty victim is written back
         if self.replacement_policy == 2:
-            self.future_table[index].pop(0)
-        return status
-
-    def issue_writeback(self, instruction):
-        self.is_write_back = True
-        self.write_back_inst = instruction
-
-    def issue_invalidate(self, instruction):
-        self.is_issue_invalidate = True
-        self.invalidate_inst = instruction
-
-    def clear_validation_flags(self):
-        self.is_issue_invalidate = False
-        self.invalidate_inst = ""
+            self.record_next_use(index, tag, next_use)
+        elif self.track_next_uses:
+            self.next_uses[index * self.associativity + self.lookup_table[index][tag]] = next_use
+        return status, victim
 
     def invalidate_block(self, instruction):
+        """
+        Back-invalidates the block holding the instruction, if present.
+        The block is found through the tag lookup table of its set, without scanning the set, and a
+        dirty block is written straight to memory (a direct writeback).
+        The way is emptied and handed to free_way so that the next fill of the set reuses it.
+        :return: NONE
+        """
         index, tag = self.get_instruction_components(instruction)
-        for block in self.block_container[index]:
-            if block.tag == tag:
-                block.isValid = False
-                if block.isDirty:
-                    self.measurements['direct_writeback'] += 1
-                break
+        lookup = self.lookup_table.get(index)  # a set never accessed holds nothing to invalidate
+        way = None if lookup is None else lookup.pop(tag, None)
+        if way is not None:
+            slot = index * self.associativity + way
+            if self.dirty_bits[slot]:
+                self.measurements['direct_writeback'] += 1
+            self.tags[slot] = 0
+            self.block_addresses[slot] = 0
+            self.stamps[slot] = -1
+            self.dirty_bits[slot] = 0
+            self.valid_bits[slot] = 0
+            if self.track_next_uses:
+                self.next_uses[slot] = -1
+            self.free_way(index, way)
+
+    def free_way(self, index, way):
+        heapq.heappush(self.free_ways[index], way)
 
     def get_dimensions(self):
         """
@@ -189,26 +259,68 @@ class Cache:
         self.number_of_index_bits = int(math.log(self.num_of_sets, 2))
         self.number_of_offset_bits = int(math.log(self.block_size, 2))
         self.number_of_tag_bits = 32 - (self.number_of_index_bits + self.number_of_offset_bits)
+        self.index_mask = self.num_of_sets - 1
 
     def get_instruction_components(self, instruction):
         """
-        The instruction received by the cache will be a 32 bit hex instruction.
+        The instruction received by the cache will be a 32 bit integer address.
         To perform operations on the cache, we need to separate its components
         and determine the index and tag for the operation.
         :return: index of the cache at which the operation is to be done.
                  tag of the instruction.
         """
-        binary_instruction = str(bin(int(instruction, base=16)))[2:].zfill(32)
-
-        if self.num_of_sets == 1:
-            index = 0
-        else:
-            index = int(binary_instruction[self.number_of_tag_bits:32 - self.number_of_offset_bits], 2)
-        #tag = "0x" + '{:0{}x}'.format(int(binary_instruction[:self.number_of_tag_bits], 2),
-        #                              int(self.number_of_tag_bits / 4))
-        tag = hex(int(binary_instruction[:self.number_of_tag_bits], 2))
+        index = (instruction >> self.number_of_offset_bits) & self.index_mask
+        tag = instruction >> (self.number_of_offset_bits + self.number_of_index_bits)
         return index, tag
 
+    def decode_addresses(self, addresses):
+        """
+        Vectorized form of get_instruction_components for a whole column of addresses,
+        so that the decoding is done once per trace instead of once per access.
+        :return: index array and tag array of the addresses
+        """
+        return decode_addresses(addresses, self.number_of_offset_bits, self.number_of_index_bits)
+
+    def get_state_arrays(self):
+        """
+        :return: A dict of numpy views of the cache state columns, each shaped (num_of_sets, associativity).
+        The views share memory with the cache.
+        """
+        shape = (self.num_of_sets, self.associativity)
+        arrays = {
+            "tags": np.frombuffer(self.tags, dtype=np.int64).reshape(shape),
+            "valid_bits": np.frombuffer(self.valid_bits, dtype=np.uint8).reshape(shape),
+            "dirty_bits": np.frombuffer(self.dirty_bits, dtype=np.uint8).reshape(shape),
+            "stamps": np.frombuffer(self.stamps, dtype=np.int64).reshape(shape),
+            "block_addresses": np.frombuffer(self.block_addresses, dtype=np.uint32).reshape(shape),
+        }
+        if self.track_next_uses:
+            arrays["next_uses"] = np.frombuffer(self.next_uses, dtype=np.int64).reshape(shape)
+        return arrays
+
+    def rebuild_lookup(self):
+        """
+        Rebuilds the lookup tables, free ways and Optimal heaps of a cache built empty, after its
+        state columns were written directly (see Batch.CacheBatch.store and Checkpoint.restore).
+        The lookup order of a set follows the LRU stamps. Sets without a valid block stay empty.
+        :return: NONE
+        """
+        state = self.get_state_arrays()
+        valid = state['valid_bits'].astype(bool)
+        for index in np.flatnonzero(valid.any(1)).tolist():
+            lookup = self.lookup_table[index]
+            tags = state['tags'][index].tolist()
+            for way in np.argsort(state['stamps'][index], kind='stable').tolist():  # least recently used first
+                if valid[index, way]:
+                    lookup[tags[way]] = way
+            if self.replacement_policy != 1:  # PLRU fills the way its tree points to instead
+                self.free_ways[index][:] = np.flatnonzero(~valid[index]).tolist()
+            if self.replacement_policy == 2:
+                heap = self.opt_heaps[index]
+                heap[:] = [(-next_use, way) for way, next_use in enumerate(state['next_uses'][index].tolist())
+                           if next_use >= 0]
+                heapq.heapify(heap)
+
     def getMissRate(self, cache_level):
         if cache_level == 1:
             self.measurements['miss_rate'] = (self.measurements['reads_miss'] + self.measurements['writes_miss']) \
@@ -235,244 +347,269 @@ class Cache:
     def display_cache_content(self):
         for i in range(self.num_of_sets):
             print("Set", i, ":", end=" ")
-            for j in range(self.associativity):
-                dirty = "D" if self.block_container[i][j].isDirty else ""
-                print(self.block_container[i][j].tag[2:], dirty,
-                      # self.block_container[i][j].time,
+            for slot in range(i * self.associativity, (i + 1) * self.associativity):
+                dirty = "D" if self.dirty_bits[slot] else ""
+                print(format_tag(self.tags[slot] if self.valid_bits[slot] else None), dirty,
+                      # self.stamps[slot],
                       end=" ")
             print("")
 
     # ================================== Eviction Policies ==================================
-    def evictLRU(self, block_set, tag, time, mode, instruction):
-        min_index = block_set.index(min(block_set, key=lambda x: x.time))
-        block_set[min_index].tag = tag
-        block_set[min_index].time = time
-
-        if not self.is_highest_level and self.inclusion_property == 1:
-            self.issue_invalidate(block_set[min_index].instruction)
-
-        if block_set[min_index].isDirty:
-            self.measurements['num_writebacks'] += 1  # if block is dirty, write-back will be issued
-            self.issue_writeback(block_set[min_index].instruction)
-        block_set[min_index].instruction = instruction
+    def evictLRU(self, index, tag, time, mode, instruction):
+        lookup = self.lookup_table[index]
+        min_index = lookup.popitem(last=False)[1]  # least recently used way
+        lookup[tag] = min_index
+        slot = index * self.associativity + min_index
+        self.tags[slot] = tag
+        self.stamps[slot] = time
+
+        victim = (self.block_addresses[slot], self.dirty_bits[slot],
+                  self.next_uses[slot] if self.track_next_uses else None)
+        self.block_addresses[slot] = instruction
         if mode == 'r':
-            block_set[min_index].isDirty = False
-        else:
-            block_set[min_index].isDirty = True
-
-    def evictPLRU(self, block_set, tag, time, mode):
-        pass
-
-    def evictOPT(self, block_set, tag, time, mode, index, instruction):
-        if len(self.future_table[index]) > 0:
-            timestamp_dict = {}
-            for i in block_set:
-                j = 0
-                while i.tag != self.future_table[index][j]:
-                    j += 1
-                    if j >= len(self.future_table[index]):
-                        timestamp_dict[i.tag] = math.inf
-                        break
-                timestamp_dict[i.tag] = j
-            tag_to_evict = max(timestamp_dict, key=timestamp_dict.get)
-            for block in block_set:
-                if block.tag == tag_to_evict:
-                    block.tag = tag
-                    block.time = time
-
-                    if not self.is_highest_level and self.inclusion_property == 1:
-                        self.issue_invalidate(block.instruction)
-
-                    if block.isDirty:
-                        self.measurements['num_writebacks'] += 1  # if block is dirty, write-back will be issued
-                        self.issue_writeback(block.instruction)
-                    block.instruction = instruction
-
-                    if mode == 'r':
-                        block.isDirty = False
-                    else:
-                        block.isDirty = True
-                    break
+            self.dirty_bits[slot] = 0
         else:
-            block_set[0].tag = tag
-            block_set[0].time = time
+            self.dirty_bits[slot] = 1
+        return victim
 
-            if not self.is_highest_level and self.inclusion_property == 1:
-                self.issue_invalidate(block_set[0].instruction)
+    def evictOPT(self, index, tag, time, mode, instruction):
+        """
+        Belady eviction: the victim is the block whose next use is farthest in the future.
+        Each set keeps a max-heap of (next use, way) entries that is updated lazily, so entries
+        whose way has been refilled or re-referenced since they were pushed are skipped here.
+        Blocks that are never used again tie, and the lowest such way is evicted.
+        """
+        base = index * self.associativity
+        heap = self.opt_heaps[index]
+        while True:
+            neg_next_use, way = heapq.heappop(heap)
+            if self.next_uses[base + way] == -neg_next_use:
+                break
+        slot = base + way
+        lookup = self.lookup_table[index]
+        lookup[tag] = lookup.pop(self.tags[slot])
+        self.tags[slot] = tag
+        self.stamps[slot] = time
 
-            if block_set[0].isDirty:
-                self.measurements['num_writebacks'] += 1  # if block is dirty, write-back will be issued
-                self.issue_writeback(block_set[0].instruction)
+        victim = (self.block_addresses[slot], self.dirty_bits[slot], self.next_uses[slot])
+        self.block_addresses[slot] = instruction
+        self.next_uses[slot] = -1  # set by record_next_use once the access completes
 
-            block_set[0].instruction = instruction
+        if mode == 'r':
+            self.dirty_bits[slot] = 0
+        else:
+            self.dirty_bits[slot] = 1
+        return victim
 
-            if mode == 'r':
-                block_set[0].isDirty = False
-            else:
-                block_set[0].isDirty = True
+    def record_next_use(self, index, tag, next_use):
+        """
+        Stores the next use of the block that was just accessed and pushes it on the set's heap.
+        The heap is rebuilt from the live blocks once stale entries outnumber them.
+        """
+        base = index * self.associativity
+        way = self.lookup_table[index][tag]
+        self.next_uses[base + way] = next_use
+        heap = self.opt_heaps[index]
+        heapq.heappush(heap, (-next_use, way))
+        if len(heap) > 4 * self.associativity:
+            heap[:] = [(-self.next_uses[base + j], j) for j in range(self.associativity)
+                       if self.next_uses[base + j] >= 0]
+            heapq.heapify(heap)
 
     # ================================= PLRU ==============================
-    def createTree(self, height):
-        root = Node.Node(0)
-        stack = [root]
-        node_id_counter = 1
-        for i in range(height):
-            for j in range(2 ** i):
-                tempNode = stack.pop(0)
-
-                leftNode = Node.Node(node_id_counter, parent=tempNode)
-                node_id_counter += 1
-
-                rightNode = Node.Node(node_id_counter, parent=tempNode)
-                node_id_counter += 1
-
-                tempNode.left = leftNode
-                tempNode.right = rightNode
-                stack.extend([leftNode, rightNode])
-        self.populateTree(root)
-        return root
-
-    def populateTree(self, root):
-        stack = [root]
-        while stack:
-            node = stack.pop(0)
-            if node.left is None and node.right is None:
-                # create block here
-                block = Block.Block()
-                node.block = block
-                continue
-            if node.left:
-                stack.append(node.left)
-            if node.right:
-                stack.append(node.right)
-
-    def updateTree(self, root, tag, r_w, instruction, mode="r"):
-        """
-        mode = a => access
-               r => replace
-        :return: The leaf node
-        """
-        node = root
-        while node.block is None:
-            if node.bit == 0:
-                nextNode = node.left if mode == "a" else node.right
+    def build_plru_masks(self):
+        """
+        The tree of a set is stored as an integer with one bit per internal node, numbered in
+        breadth first order (node k has children 2k+1 and 2k+2). Way w is the leaf 'associativity - 1 + w'.
+        A bit of 0 means the left subtree was used more recently, 1 the right one.
+        For every way, precomputes the masks that point all nodes on its path towards it.
+        :return: A list of (and_mask, or_mask) pairs indexed by way
+        """
+        masks = []
+        for way in range(self.associativity):
+            and_mask, or_mask = -1, 0
+            node = self.associativity - 1 + way
+            while node:
+                parent = (node - 1) >> 1
+                and_mask &= ~(1 << parent)
+                if not node & 1:  # right child
+                    or_mask |= 1 << parent
+                node = parent
+            masks.append((and_mask, or_mask))
+        return masks
+
+    def updateTree(self, index, tag, r_w, instruction):
+        """
+        Follows the bits away from the recently used side down to a leaf, flipping every bit
+        on the way, and replaces the block of that leaf.
+        :return: The victim, see evict
+        """
+        bits = self.plru_bits[index]
+        node = 0
+        last_internal_node = self.associativity - 1
+        while node < last_internal_node:
+            if bits >> node & 1:
+                bits &= ~(1 << node)
+                node = 2 * node + 1
             else:
-                nextNode = node.right if mode == "a" else node.left
-            node.bit = 0 if node.bit else 1
-            node = nextNode
+                bits |= 1 << node
+                node = 2 * node + 2
+        self.plru_bits[index] = bits
+        return self.replace_way(index, node - last_internal_node, tag, r_w, instruction)
 
-        if mode == 'r':
-            node.block.tag = tag
-            if node.block.isDirty:
-                self.measurements['num_writebacks'] += 1
-                self.issue_writeback(node.block.instruction)
+    def replace_way(self, index, way, tag, r_w, instruction):
+        """
+        Puts the block of the instruction in the way chosen by the tree.
+        :return: The victim, see evict
+        """
+        slot = index * self.associativity + way
+        lookup = self.lookup_table[index]
+        victim = None
+        if self.valid_bits[slot]:
+            del lookup[self.tags[slot]]
+            victim = (self.block_addresses[slot], self.dirty_bits[slot],
+                      self.next_uses[slot] if self.track_next_uses else None)
+        lookup[tag] = way
+        self.tags[slot] = tag
+        self.stamps[slot] = self.timestamp
+        self.valid_bits[slot] = 1
+
+        self.block_addresses[slot] = instruction
+
+        if r_w == 'w':
+            self.dirty_bits[slot] = 1
+        else:
+            self.dirty_bits[slot] = 0
+        return victim
+
+    def update_hit_tree(self, index, way, mode):
+        and_mask, or_mask = self.plru_masks[way]
+        self.plru_bits[index] = self.plru_bits[index] & and_mask | or_mask
+        slot = index * self.associativity + way
+        self.stamps[slot] = self.timestamp
+        if mode == 'w':
+            self.dirty_bits[slot] = 1
 
-            node.block.instruction = instruction
+    def get_plru_bits(self):
+        """
+        :return: The PLRU tree of every set as an integer, see build_plru_masks
+        """
+        return list(self.plru_bits)
 
-            if r_w == 'w':
-                node.block.isDirty = True
-            else:
-                node.block.isDirty = False
-        return node
-
-    def update_hit_tree(self, root, path_to_leaf, mode):
-        tempNode = root
-        for i in range(len(path_to_leaf) - 1):
-            if tempNode.block is None:
-                if tempNode.left.node_id == path_to_leaf[i+1]:
-                    tempNode.bit = 0
-                    tempNode = tempNode.left
-                else:
-                    tempNode.bit = 1
-                    tempNode = tempNode.right
-        if mode == 'w':
-            tempNode.block.isDirty = True
-
-    def print_tree(self, root):
-        if root.block is None:
-            print("Node ID: ", root.node_id, "Bit: ", root.bit)
-        if root.left:
-            self.print_tree(root.left)
-        if root.right:
-            self.print_tree(root.right)
-        if root.block is not None:
-            print("Node ID: ", root.node_id, "Tag: => ", root.block.tag)
-
-    def get_leaf_nodes(self, root, leaf_set):
-        if root.block is None:
-            pass
-        if root.left:
-            self.get_leaf_nodes(root.left, leaf_set)
-        if root.right:
-            self.get_leaf_nodes(root.right, leaf_set)
-        if root.block is not None:
-            if root.block.tag != "":
-                leaf_set.append(root)
-        return leaf_set
-
-    def get_path(self, leaf):
-        path = [leaf.node_id]
-        tempNode = leaf
-        while tempNode.parent is not None:
-            path.append(tempNode.parent.node_id)
-            tempNode = tempNode.parent
-        path.reverse()
-        return path
+    def set_plru_bits(self, plru_bits):
+        self.plru_bits[:] = plru_bits
 
 
 class PLRUCache(Cache):
     def __init__(self, *args, **kwargs):
         super(PLRUCache, self).__init__(*args, **kwargs)
 
-    def read(self, instruction):
-        index, tag = self.get_instruction_components(instruction)
-
-        root = self.block_container[index][0]
-        leaf_set = self.get_leaf_nodes(root, [])
-
-        if len(leaf_set) < self.associativity:
-            self.updateTree(root, tag, 'r', instruction)
-            return 1
-        elif tag in [x.block.tag for x in leaf_set]:
-            path_to_leaf = []
-            for leaf in leaf_set:
-                if leaf.block.tag == tag:
-                    path_to_leaf = self.get_path(leaf)
-                    break
-            self.update_hit_tree(root, path_to_leaf, 'r')
-            return 0
-        else:
-            self.updateTree(root, tag, 'r', instruction)
-            return 2
-
-    def write(self, instruction):
-        index, tag = self.get_instruction_components(instruction)
-
-        root = self.block_container[index][0]
-        leaf_set = self.get_leaf_nodes(root, [])
-
-        if len(leaf_set) < self.associativity:
-            self.updateTree(root, tag, 'w', instruction)
-            return 1
-        elif tag in [x.block.tag for x in leaf_set]:
-            path_to_leaf = []
-            for leaf in leaf_set:
-                if leaf.block.tag == tag:
-                    path_to_leaf = self.get_path(leaf)
-                    break
-            self.update_hit_tree(root, path_to_leaf, 'w')
-            return 0
-        else:
-            self.updateTree(root, tag, 'w', instruction)
-            return 2
+    def read(self, instruction, index, tag):
+        lookup = self.lookup_table[index]
+        way = lookup.get(tag)
+        if way is not None:
+            self.update_hit_tree(index, way, 'r')
+            return HIT
+        # The replaced leaf is chosen by the tree even while the set still has empty ways
+        status = 1 if len(lookup) < self.associativity else 2
+        return status, self.updateTree(index, tag, 'r', instruction)
+
+    def write(self, instruction, index, tag):
+        lookup = self.lookup_table[index]
+        way = lookup.get(tag)
+        if way is not None:
+            self.update_hit_tree(index, way, 'w')
+            return HIT
+        status = 1 if len(lookup) < self.associativity else 2
+        return status, self.updateTree(index, tag, 'w', instruction)
+
+    def free_way(self, index, way):
+        """
+        Fills are placed by the tree, so instead of keeping free ways, the nodes on the path of the
+        emptied way are pointed away from it and the next replacement in the set takes it.
+        """
+        and_mask, or_mask = self.plru_masks[way]
+        self.plru_bits[index] = self.plru_bits[index] & and_mask | ~and_mask & ~or_mask
 
     def display_cache_content(self):
         for i in range(self.num_of_sets):
             print("Set", i, ":", end=" ")
-            leaf_set = self.get_leaf_nodes(self.block_container[i][0], [])
-            for j in range(len(leaf_set)):
-                dirty = "D" if leaf_set[j].block.isDirty else ""
-                print(leaf_set[j].block.tag[2:], dirty,
-                      # self.block_container[i][j].time,
+            for slot in range(i * self.associativity, (i + 1) * self.associativity):
+                if not self.valid_bits[slot]:
+                    continue
+                dirty = "D" if self.dirty_bits[slot] else ""
+                print(format_tag(self.tags[slot]), dirty,
                       end=" ")
-            print("")
\ No newline at end of file
+            print("")
+
+
+class FullyAssociativePLRUCache(PLRUCache):
+    """
+    Pseudo-LRU over a single set, such as the "full" associativity of Graphs.py (size / block size ways).
+    A tree of thousands of ways does not fit a machine word, and the masks of build_plru_masks would
+    take memory and time quadratic in the associativity, so the tree is a bytearray with one byte per
+    node instead, and hits, replacements and invalidations walk the log2(associativity) nodes of one path.
+    The nodes are numbered and their bits read as in build_plru_masks.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(FullyAssociativePLRUCache, self).__init__(*args, **kwargs)
+
+    def build_cache(self):
+        super(FullyAssociativePLRUCache, self).build_cache()
+        self.plru_bits = []
+        self.plru_tree = bytearray(self.associativity - 1)
+
+    def build_plru_masks(self):
+        return []
+
+    def updateTree(self, index, tag, r_w, instruction):
+        tree = self.plru_tree
+        node = 0
+        last_internal_node = self.associativity - 1
+        while node < last_internal_node:
+            bit = tree[node]
+            tree[node] = bit ^ 1
+            node = 2 * node + 2 - bit  # away from the recently used side
+        return self.replace_way(index, node - last_internal_node, tag, r_w, instruction)
+
+    def update_hit_tree(self, index, way, mode):
+        tree = self.plru_tree
+        node = self.associativity - 1 + way
+        while node:
+            parent = (node - 1) >> 1
+            tree[parent] = ~node & 1  # 0 when the used way is on the left
+            node = parent
+        self.stamps[way] = self.timestamp
+        if mode == 'w':
+            self.dirty_bits[way] = 1
+
+    def free_way(self, index, way):
+        tree = self.plru_tree
+        node = self.associativity - 1 + way
+        while node:
+            parent = (node - 1) >> 1
+            tree[parent] = node & 1
+            node = parent
+
+    def get_plru_bits(self):
+        nodes = np.frombuffer(self.plru_tree, dtype=np.uint8)
+        return [int.from_bytes(np.packbits(nodes, bitorder='little').tobytes(), 'little')]
+
+    def set_plru_bits(self, plru_bits):
+        width = (self.associativity + 6) // 8
+        packed = np.frombuffer(plru_bits[0].to_bytes(width, 'little'), dtype=np.uint8)
+        self.plru_tree[:] = np.unpackbits(packed, bitorder='little')[:self.associativity - 1].tobytes()
+
+
+def is_fully_associative(size, associativity, block_size):
+    return bool(size) and size == associativity * block_size
+
+
+def cache_class(replacement_policy, size, associativity, block_size):
+    """
+    :return: The Cache class that simulates a configuration, FullyAssociativePLRUCache for a single PLRU set
+    """
+    if replacement_policy != 1:
+        return Cache
+    return FullyAssociativePLRUCache if is_fully_associative(size, associativity, block_size) else PLRUCache
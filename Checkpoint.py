@@ -0,0 +1,149 @@
+import contextlib
+import hashlib
+import json
+import math
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+import Hierarchy
+import Simulator
+import Trace
+
+CHECKPOINT_VERSION = 1
+DEFAULT_INTERVAL = 1 << 20  # references simulated between two checkpoints
+# The cache attributes that a checkpoint must match to be restored into a cache
+GEOMETRY = ('name', 'size', 'associativity', 'block_size', 'replacement_policy', 'inclusion_property')
+
+
+def trace_digest(trace):
+    """
+    Hashes the references of a trace, so that a checkpoint is never resumed on another trace.
+    :return: The hex SHA-256 of the trace columns
+    """
+    digest = hashlib.sha256(str(len(trace)).encode())
+    for ops, addresses in trace.chunks():
+        digest.update(np.ascontiguousarray(ops, dtype=np.uint8).tobytes())
+        digest.update(np.ascontiguousarray(addresses, dtype='<u4').tobytes())
+    return digest.hexdigest()
+
+
+def _geometry(cache):
+    return {name: getattr(cache, name) for name in GEOMETRY}
+
+
+def save(path, hierarchy, position, digest):
+    """
+    Writes the full state of a hierarchy to a compressed .npz file: the state columns, PLRU bits,
+    timestamp and measurements of every cache, and the trace position to resume from.
+    The file is written next to path and renamed over it, so a run interrupted while saving
+    leaves the previous checkpoint intact.
+    :param position: The number of trace references simulated so far
+    :param digest: The trace_digest of the trace
+    :return: NONE
+    """
+    meta = {'version': CHECKPOINT_VERSION, 'position': position, 'trace': digest,
+            'inclusive': hierarchy.inclusive, 'caches': []}
+    arrays = {}
+    for level, cache in enumerate(hierarchy.caches):
+        meta['caches'].append(dict(_geometry(cache), timestamp=None if cache.timestamp < 0 else cache.timestamp,
+                                   measurements=cache.measurements))
+        for name, column in cache.get_state_arrays().items():
+            arrays['{}_{}'.format(level, name)] = column
+        if cache.replacement_policy == 1:
+            width = max(1, (cache.associativity + 6) // 8)  # associativity - 1 tree bits per set
+            packed = b''.join(bits.to_bytes(width, 'little') for bits in cache.get_plru_bits())
+            arrays['{}_plru_bits'.format(level)] = np.frombuffer(packed, dtype=np.uint8).reshape(-1, width)
+    arrays['meta'] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def restore(path, hierarchy, digest=None):
+    """
+    Loads a checkpoint into a hierarchy of freshly built caches of the same geometry.
+    :param digest: The trace_digest of the trace to resume on, checked against the checkpoint's
+    :return: The trace position to resume from
+    :raises ValueError: If the checkpoint is of another hierarchy or trace
+    """
+    with np.load(path) as arrays:
+        meta = json.loads(arrays['meta'].tobytes().decode())
+        if meta['version'] != CHECKPOINT_VERSION:
+            raise ValueError("{} is a version {} checkpoint, expected version {}".format(
+                path, meta['version'], CHECKPOINT_VERSION))
+        if digest is not None and meta['trace'] != digest:
+            raise ValueError("{} was taken on another trace".format(path))
+        saved = [{name: cache[name] for name in GEOMETRY} for cache in meta['caches']]
+        if saved != [_geometry(cache) for cache in hierarchy.caches] or meta['inclusive'] != hierarchy.inclusive:
+            raise ValueError("{} was taken on another hierarchy".format(path))
+
+        for level, (cache, cache_meta) in enumerate(zip(hierarchy.caches, meta['caches'])):
+            for name, column in cache.get_state_arrays().items():
+                key = '{}_{}'.format(level, name)
+                if key in arrays:
+                    column[:] = arrays[key]
+            if cache.replacement_policy == 1:
+                cache.set_plru_bits([int.from_bytes(row, 'little')
+                                     for row in arrays['{}_plru_bits'.format(level)]])
+            cache.rebuild_lookup()
+            cache.timestamp = -math.inf if cache_meta['timestamp'] is None else cache_meta['timestamp']
+            cache.measurements.update(cache_meta['measurements'])
+    return meta['position']
+
+
+def simulate_resumable(config, trace, path, interval=DEFAULT_INTERVAL, stop=None, out_of_core=False):
+    """
+    Simulator.simulate with a checkpoint at path every interval references. If path already holds
+    a checkpoint of the same config and trace, the simulation resumes from it instead of starting
+    over, so a run that was stopped loses at most interval references of work.
+    With stop, the simulation ends after that many references and the checkpoint at path holds the
+    warmed hierarchy. restore() loads it into any number of fresh hierarchies, each of which can then
+    continue from there on its own.
+    :param config: A Simulator.Config, or a tuple of its fields
+    :param trace: A Trace, or the path of a text or packed trace file. Streams cannot be resumed.
+    :param out_of_core: Keep the Optimal policy's next-use array in a temporary file, as for Simulator.simulate
+    :return: The Simulator.Result of the references simulated so far
+    """
+    config = Simulator.Config(*config).validate()
+    if not isinstance(trace, Trace.Trace):
+        trace = Trace.read_trace(trace)
+    if isinstance(trace, Trace.TraceStream):
+        raise ValueError("A checkpointed simulation needs the whole trace and cannot be run on a stream")
+    l1_cache, l2_cache = Simulator.build_hierarchy(config)
+    hierarchy = Hierarchy.Hierarchy([l1_cache, l2_cache] if config.l2size else [l1_cache])
+    digest = trace_digest(trace)
+    position = restore(path, hierarchy, digest) if os.path.exists(path) else 0
+    stop = len(trace) if stop is None else min(stop, len(trace))
+    with contextlib.ExitStack() as stack:
+        next_use = None
+        if config.rep_pol == 2:
+            next_use = stack.enter_context(Simulator.next_use_array(trace, config.blocksize, out_of_core))
+        while position < stop:
+            end = min(position + interval, stop)
+            hierarchy.run(trace, next_use, position, end)
+            position = end
+            save(path, hierarchy, position, digest)
+    return Simulator.collect_result(config, l1_cache, l2_cache)
+
+
+if __name__ == "__main__":
+    # python Checkpoint.py <checkpoint_file>
+    # Describes a checkpoint: its trace position and the measurements of every cache
+    with np.load(sys.argv[1]) as checkpoint:
+        checkpoint_meta = json.loads(checkpoint['meta'].tobytes().decode())
+    print("position:", checkpoint_meta['position'])
+    for saved_cache in checkpoint_meta['caches']:
+        print("{name}: {size} bytes, {associativity}-way, {block_size} byte blocks, policy {replacement_policy}, "
+              "inclusion {inclusion_property}".format(**saved_cache))
+        print("   ", saved_cache['measurements'])
@@ -0,0 +1,136 @@
+from typing import NamedTuple
+
+import Cache
+import Trace
+
+
+class Level(NamedTuple):
+    """
+    One cache of a hierarchy. rep_pol is 0 for LRU, 1 for PLRU and 2 for Optimal; inc_pol is 1 when
+    the level is inclusive of the levels above it, which are then back-invalidated on its evictions.
+    """
+    size: int
+    assoc: int
+    rep_pol: int = 0
+    inc_pol: int = 0
+
+
+def build_caches(blocksize, levels):
+    """
+    Creates the caches of a hierarchy, L1 first. All levels share the block size.
+    Levels above an Optimal level keep the next use of their blocks, for the writebacks into it.
+    :return: A list of Cache
+    """
+    caches = []
+    for position, level in enumerate(levels):
+        cache_class = Cache.cache_class(level.rep_pol, level.size, level.assoc, blocksize)
+        caches.append(cache_class(size=level.size, associativity=level.assoc, block_size=blocksize,
+                                  inclusion_property=level.inc_pol, replacement_policy=level.rep_pol,
+                                  is_highest=position == 0, name="L{}".format(position + 1),
+                                  track_next_uses=any(lower.rep_pol == 2 for lower in levels[position + 1:])))
+    return caches
+
+
+class Hierarchy:
+    """
+    Any number of caches, L1 first, each backed by the next one and the last by memory.
+    A miss at a level, read or write, reads the block from the level below it.
+    Caches report the block an access replaced instead of raising flags, and the hierarchy forwards it:
+    a dirty victim is written into the level below, and the victim of an inclusive level is
+    back-invalidated in every level above it.
+    """
+
+    def __init__(self, caches, inclusive=None):
+        """
+        :param caches: The caches, L1 first
+        :param inclusive: Whether each level back-invalidates the levels above it,
+                          the inclusion_property of the caches when not given
+        """
+        self.caches = list(caches)
+        if inclusive is None:
+            inclusive = [cache.inclusion_property == 1 for cache in self.caches]
+        self.inclusive = [bool(position and flag) for position, flag in enumerate(inclusive)]
+        # The caches that each level back-invalidates, empty for the non-inclusive levels
+        self.invalidated = [self.caches[:position] if flag else [] for position, flag in enumerate(self.inclusive)]
+
+    def run(self, trace, next_use=None, start=0, stop=None):
+        """
+        Simulates every reference of a trace, or those from start up to stop. The index and tag of
+        each reference are decoded for every level in advance (see Trace.decoded), so an access only
+        reaches a lower level's Python code when every level above it missed.
+        :param next_use: The next-use array of the trace, needed when a level uses the Optimal policy
+        :return: NONE
+        """
+        if start or stop is not None:
+            trace = Trace.Trace(trace.ops[start:stop], trace.addresses[start:stop], trace.path)
+            if next_use is not None:
+                next_use = next_use[start:stop]
+        caches = self.caches
+        depth = len(caches)
+        if next_use is None:
+            references = ((inst, None, *components) for inst, *components in trace.decoded(*caches))
+        else:
+            references = trace.decoded(*caches, next_use=next_use)
+        for reference in references:
+            op, address = reference[0]
+            inst_next_use = reference[1]
+            write = op == 'w'
+            level = 0
+            while True:
+                status, victim = caches[level].access(write, address, reference[2 * level + 2],
+                                                      reference[2 * level + 3], inst_next_use)
+                if victim is not None:
+                    self.evicted(level, victim)
+                level += 1
+                if not status or level == depth:
+                    break
+                write = False
+
+    def evicted(self, level, victim):
+        """
+        Handles the victim (see Cache.evict) of an access at a level.
+        :return: NONE
+        """
+        address, dirty, next_use = victim
+        for cache in self.invalidated[level]:
+            cache.invalidate_block(address)
+        if dirty and level + 1 < len(self.caches):
+            self.writeback(level + 1, address, next_use)
+
+    def writeback(self, level, address, next_use=None):
+        """
+        Writes a dirty block into a level. If the level misses, the block is read from the levels below.
+        :return: NONE
+        """
+        write = True
+        while level < len(self.caches):
+            status, victim = self.caches[level].access(write, address, next_use=next_use)
+            if victim is not None:
+                self.evicted(level, victim)
+            if not status:
+                break
+            write = False
+            level += 1
+
+    def finalize(self):
+        """
+        Computes the miss rate and memory traffic of every level into its measurements.
+        The L1 miss rate counts every access, the lower levels only their reads.
+        Blocks that an inclusive level back-invalidates while they are dirty are written straight
+        to memory, and count towards the memory traffic of every inclusive level below them.
+        :return: NONE
+        """
+        direct_writebacks = 0
+        for position, cache in enumerate(self.caches):
+            cache.getMissRate(1 if position == 0 else 2)
+            cache.getMemoryTraffic(1 if position == 0 else 2, direct_writebacks)
+            direct_writebacks += cache.measurements['direct_writeback']
+
+    def memory_traffic(self):
+        """
+        :return: The blocks moved between the last level and memory: its misses and writebacks,
+                 and the direct writebacks of every level
+        """
+        last = self.caches[-1].measurements
+        return (last['reads_miss'] + last['writes_miss'] + last['num_writebacks']
+                + sum(cache.measurements['direct_writeback'] for cache in self.caches))
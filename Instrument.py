@@ -0,0 +1,230 @@
+import cProfile
+import collections
+import functools
+import sys
+import time
+import tracemalloc
+
+import Cache
+import Hierarchy
+import Trace
+
+STATUS_NAMES = ('hits', 'fills', 'replacements')  # by the status returned by Cache.read/write
+TRACEMALLOC_TOP = 25
+
+
+class Profiler:
+    """
+    Per-phase timers and event counters. Phases nest: the time of a phase is charged to it alone
+    ('self') and to it and every phase it calls ('total'), so that the self times add up.
+    """
+
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.self_time = collections.Counter()
+        self.total_time = collections.Counter()
+        self.events = collections.Counter()
+        self.stack = []
+        self.started = time.perf_counter()
+        self.last = self.started
+
+    def enter(self, phase):
+        now = time.perf_counter()
+        if self.stack:
+            self.self_time[self.stack[-1][0]] += now - self.last
+        self.stack.append((phase, now))
+        self.calls[phase] += 1
+        self.last = now
+
+    def exit(self):
+        now = time.perf_counter()
+        phase, entered = self.stack.pop()
+        self.self_time[phase] += now - self.last
+        self.total_time[phase] += now - entered
+        self.last = now
+
+    def count(self, event, n=1):
+        self.events[event] += n
+
+    def print_summary(self, file=None):
+        elapsed = time.perf_counter() - self.started
+        print("===== Instrumentation =====", file=file)
+        print("{:<20} {:>10} {:>10} {:>10} {:>7}".format("phase", "calls", "self (s)", "total (s)", "self %"),
+              file=file)
+        for phase, self_time in self.self_time.most_common():
+            print("{:<20} {:>10} {:>10.3f} {:>10.3f} {:>6.1f}%".format(
+                phase, self.calls[phase], self_time, self.total_time[phase], 100 * self_time / elapsed), file=file)
+        other = elapsed - sum(self.self_time.values())
+        print("{:<20} {:>10} {:>10.3f} {:>10.3f} {:>6.1f}%".format("other", "", other, other, 100 * other / elapsed),
+              file=file)
+        print("{:<20} {:>10} {:>10.3f}".format("elapsed", "", elapsed), file=file)
+        for event in sorted(self.events):
+            print("{:<31} {:>10}".format(event, self.events[event]), file=file)
+
+
+_profiler = None
+_patched = []  # (owner, name, original) of every attribute replaced by enable()
+
+
+def timed(phase, function):
+    """
+    Wraps a function so that its calls are timed as the given phase while instrumentation is enabled.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _profiler is None:
+            return function(*args, **kwargs)
+        _profiler.enter(phase)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _profiler.exit()
+    return wrapper
+
+
+def _lookup(function):
+    @functools.wraps(function)
+    def wrapper(self, instruction, index, tag):
+        _profiler.enter("lookup")
+        try:
+            result = function(self, instruction, index, tag)
+        finally:
+            _profiler.exit()
+        _profiler.count("{} {}".format(self.name, STATUS_NAMES[result[0]]))
+        return result
+    return wrapper
+
+
+def _victim_selection(function):
+    @functools.wraps(function)
+    def wrapper(self, *args):
+        _profiler.count("{} victim selections".format(self.name))
+        _profiler.enter("victim selection")
+        try:
+            return function(self, *args)
+        finally:
+            _profiler.exit()
+    return wrapper
+
+
+def _access(function):
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        if self.is_highest_level:
+            return function(self, *args, **kwargs)
+        # every access reaching a lower level is handed off by the level above, on a miss or a writeback
+        _profiler.enter("handoff to " + self.name)
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            _profiler.exit()
+    return wrapper
+
+
+def _invalidate_block(function):
+    @functools.wraps(function)
+    def wrapper(self, instruction):
+        _profiler.count("back-invalidations")
+        _profiler.enter("back-invalidation")
+        try:
+            return function(self, instruction)
+        finally:
+            _profiler.exit()
+    return wrapper
+
+
+def _evicted(function):
+    @functools.wraps(function)
+    def wrapper(self, level, victim):
+        if victim[1]:
+            _profiler.count("{} writebacks".format(self.caches[level].name))
+        return function(self, level, victim)
+    return wrapper
+
+
+def _patch(owner, name, wrap):
+    original = owner.__dict__[name]
+    _patched.append((owner, name, original))
+    setattr(owner, name, wrap(original))
+
+
+def enable():
+    """
+    Starts a new Profiler and wraps the Cache and Hierarchy methods of every phase with timers.
+    Nothing is wrapped until this is called, so that uninstrumented runs pay nothing for it.
+    :return: The Profiler
+    """
+    global _profiler
+    disable()
+    _profiler = Profiler()
+    _patch(Cache.Cache, 'decode_addresses', functools.partial(timed, "decode"))
+    _patch(Cache.Cache, 'get_instruction_components', functools.partial(timed, "decode"))
+    for owner in (Cache.Cache, Cache.PLRUCache):
+        _patch(owner, 'read', _lookup)
+        _patch(owner, 'write', _lookup)
+    for name in ('evictLRU', 'evictOPT', 'updateTree'):
+        _patch(Cache.Cache, name, _victim_selection)
+    _patch(Cache.FullyAssociativePLRUCache, 'updateTree', _victim_selection)
+    _patch(Cache.Cache, 'access', _access)
+    _patch(Cache.Cache, 'invalidate_block', _invalidate_block)
+    _patch(Hierarchy.Hierarchy, 'evicted', _evicted)
+    _patch(Trace.Trace, 'next_use', functools.partial(timed, "next use"))
+    _patch(Trace.Trace, 'write_next_use', functools.partial(timed, "next use"))
+    return _profiler
+
+
+def disable():
+    """
+    Restores the original Cache and Hierarchy methods.
+    :return: NONE
+    """
+    global _profiler
+    while _patched:
+        owner, name, original = _patched.pop()
+        setattr(owner, name, original)
+    _profiler = None
+
+
+def print_summary(file=None):
+    if _profiler is not None:
+        _profiler.print_summary(file)
+
+
+class Capture:
+    """
+    Optional whole-run captures: a cProfile profile, written with pstats' dump_stats format,
+    and a tracemalloc report of the peak traced memory and the largest allocation sites.
+    """
+
+    def __init__(self, profile_file=None, tracemalloc_file=None):
+        self.profile_file = profile_file
+        self.tracemalloc_file = tracemalloc_file
+        self.profile = None
+
+    def start(self):
+        if self.tracemalloc_file:
+            tracemalloc.start()
+        if self.profile_file:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stop(self):
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.profile_file)
+        if self.tracemalloc_file:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(self.tracemalloc_file, "w") as f:
+                print("current traced memory:", current, "bytes", file=f)
+                print("peak traced memory:", peak, "bytes", file=f)
+                for stat in snapshot.statistics('lineno')[:TRACEMALLOC_TOP]:
+                    print(stat, file=f)
+
+
+if __name__ == "__main__":
+    # python Instrument.py <profile_file>
+    # Prints the functions of a --profile capture by cumulative time
+    import pstats
+    pstats.Stats(sys.argv[1]).sort_stats('cumulative').print_stats(30)
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from typing import NamedTuple
+
+MISS_CLASSES = ('compulsory', 'capacity', 'conflict')
+
+
+class MissCounts(NamedTuple):
+    compulsory: int
+    capacity: int
+    conflict: int
+
+
+class MissClassifier:
+    """
+    Classifies the misses of a cache with the 3C model, in the same pass as the simulation.
+    A miss on a block the cache has never held is compulsory. Any other miss is a capacity miss if
+    a fully-associative LRU cache of the same capacity, fed the same accesses, misses too, and a
+    conflict miss if that shadow cache hits.
+    The shadow is an OrderedDict of block numbers in recency order, so each access costs it O(1).
+    It only sees the cache's accesses, not its back-invalidations, so a miss on a block that an
+    inclusive lower level invalidated counts as a conflict or capacity miss.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.capacity = cache.num_of_sets * cache.associativity
+        self.shadow = OrderedDict()
+        self.touched = set()
+        # per set counts, one list per class
+        self.compulsory = [0] * cache.num_of_sets
+        self.capacity_misses = [0] * cache.num_of_sets
+        self.conflict = [0] * cache.num_of_sets
+        self.original_access = None
+
+    def attach(self):
+        """
+        Wraps the access method of this one cache, so that other caches run at full speed.
+        :return: self
+        """
+        cache = self.cache
+        access = self.original_access = cache.access
+        shadow, touched, capacity = self.shadow, self.touched, self.capacity
+        compulsory, capacity_misses, conflict = self.compulsory, self.capacity_misses, self.conflict
+        offset_bits = cache.number_of_offset_bits
+        index_mask = cache.index_mask
+
+        def classified_access(write, address, index=None, tag=None, next_use=None):
+            status, victim = access(write, address, index, tag, next_use)
+            block = address >> offset_bits
+            shadow_hit = block in shadow
+            if shadow_hit:
+                shadow.move_to_end(block)
+            else:
+                shadow[block] = None
+                if len(shadow) > capacity:
+                    shadow.popitem(last=False)
+            if status:
+                if block not in touched:
+                    touched.add(block)
+                    compulsory[block & index_mask] += 1
+                elif shadow_hit:
+                    conflict[block & index_mask] += 1
+                else:
+                    capacity_misses[block & index_mask] += 1
+            return status, victim
+
+        cache.access = classified_access
+        return self
+
+    def detach(self):
+        if self.original_access is not None:
+            del self.cache.access  # back to the class method
+            self.original_access = None
+
+    def totals(self):
+        return MissCounts(sum(self.compulsory), sum(self.capacity_misses), sum(self.conflict))
+
+    def per_set(self):
+        """
+        :return: A list of MissCounts indexed by set
+        """
+        return [MissCounts(*counts) for counts in zip(self.compulsory, self.capacity_misses, self.conflict)]
+
+
+def attach(caches):
+    """
+    :return: An attached MissClassifier for every cache
+    """
+    return [MissClassifier(cache).attach() for cache in caches]
+
+
+def print_classification(classifiers, file=None):
+    """
+    Prints the miss classes of every level, in total and then per set.
+    :return: NONE
+    """
+    print("===== Miss classification =====", file=file)
+    for classifier in classifiers:
+        name = classifier.cache.name
+        print("{} {}".format(name, ", ".join("{}: {}".format(miss_class, count) for miss_class, count
+                                             in classifier.totals()._asdict().items())), file=file)
+    for classifier in classifiers:
+        print("===== {} misses per set (compulsory capacity conflict) =====".format(classifier.cache.name),
+              file=file)
+        for index, counts in enumerate(classifier.per_set()):
+            print("Set", index, ":", *counts, file=file)
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+import Sweep
+
+# The modules whose source decides what a simulation produces. Editing any of them changes
+# the simulator version, so that results of an older simulator are never served.
+SIMULATOR_SOURCES = ('Cache.py', 'Hierarchy.py', 'Trace.py', 'Simulator.py', 'Sweep.py', 'Batch.py')
+
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.results')
+DEFAULT_MAX_BYTES = 256 << 20
+ENTRY_EXTENSION = '.pkl'
+HASH_BUFFER_SIZE = 1 << 20
+
+_simulator_version = None
+_trace_hashes = {}  # (path, size, mtime) -> content hash
+
+
+def simulator_version():
+    """
+    :return: A hash of the simulator sources, computed once per process
+    """
+    global _simulator_version
+    if _simulator_version is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for source in SIMULATOR_SOURCES:
+            with open(os.path.join(directory, source), 'rb') as f:
+                digest.update(f.read())
+        _simulator_version = digest.hexdigest()
+    return _simulator_version
+
+
+def trace_hash(path):
+    """
+    Hashes the content of a trace file, so that a renamed or copied trace still finds its results.
+    The hash is remembered for as long as the file keeps its size and modification time.
+    :return: The hex SHA-256 of the file
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _trace_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BUFFER_SIZE), b''):
+                digest.update(block)
+        _trace_hashes[key] = digest.hexdigest()
+    return _trace_hashes[key]
+
+
+class ResultStore:
+    """
+    Simulation results kept on disk between runs, one pickle file per (trace, configuration).
+    An entry is written to a temporary file and renamed into place, so readers in other processes
+    only ever see complete entries. Reading an entry refreshes its modification time, and once
+    the store grows beyond max_bytes the least recently used entries are deleted.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def entry_path(self, trace_digest, config):
+        key = repr((trace_digest, tuple(int(x) for x in Sweep.SweepConfig(*config)), simulator_version()))
+        return os.path.join(self.path, hashlib.sha256(key.encode()).hexdigest() + ENTRY_EXTENSION)
+
+    def get(self, trace_digest, config):
+        """
+        :return: The stored result dict of the configuration, or None if there is none
+        """
+        path = self.entry_path(trace_digest, config)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            return None  # never stored, or evicted by another process
+        except (EOFError, pickle.UnpicklingError):
+            self.remove(path)
+            return None
+        return result
+
+    def put(self, trace_digest, config, result):
+        """
+        Stores a result dict, then evicts entries until the store fits in max_bytes.
+        :return: NONE
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.entry_path(trace_digest, config))
+        except BaseException:
+            self.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used entries while the store is larger than max_bytes.
+        :return: NONE
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.endswith(ENTRY_EXTENSION):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                    total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            if name.endswith(ENTRY_EXTENSION):
+                self.remove(os.path.join(self.path, name))
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def cached_sweep(trace_file, configs, run=Sweep.run_sweep, store=None):
+    """
+    Runs a sweep through the result store: only the configurations without a stored result are
+    simulated, with the final cache contents, and their results are stored for the next run.
+    :param trace_file: Path of a text or packed trace file
+    :param configs: Configurations as accepted by Sweep.run_sweep
+    :param run: The sweep engine, any function taking (trace_file, configs, contents=True) and
+                returning result dicts in the order of configs, such as Sweep.run_sweep,
+                Sweep.run_parallel_sweep or Batch.run_batch
+    :param store: A ResultStore, the default store when not given
+    :return: A list of result dicts, with their 'contents', in the order of configs
+    """
+    if store is None:
+        store = ResultStore()
+    configs = [Sweep.SweepConfig(*config) for config in configs]
+    trace_digest = trace_hash(trace_file)
+    results = [store.get(trace_digest, config) for config in configs]
+    missing = [position for position, result in enumerate(results) if result is None]
+    if missing:
+        for position, result in zip(missing, run(trace_file, [configs[position] for position in missing],
+                                                 contents=True)):
+            store.put(trace_digest, configs[position], result)
+            results[position] = result
+    return results
+
+
+if __name__ == "__main__":
+    # python Results.py [--clear]
+    # Reports the size of the default result store, or empties it
+    result_store = ResultStore()
+    if '--clear' in sys.argv[1:]:
+        result_store.clear()
+    names = [name for name in os.listdir(result_store.path) if name.endswith(ENTRY_EXTENSION)]
+    print(len(names), "results,", sum(os.path.getsize(os.path.join(result_store.path, name)) for name in names),
+          "bytes in", result_store.path)
@@ -0,0 +1,338 @@
+import argparse
+import math
+import sys
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+import Hierarchy
+import Simulator
+import Trace
+
+DEFAULT_STRIDE = 16
+# Interval sampling: every period fast-forwards, warms up, then measures a detailed window
+DEFAULT_DETAIL = 1000
+DEFAULT_WARMUP = 2000
+DEFAULT_FAST_FORWARD = 7000
+CONFIDENCE_Z = 1.96  # two-sided 95% normal interval
+
+# The per-level counters kept for every sampled unit
+COUNTERS = ('reads', 'reads_miss', 'writes', 'writes_miss', 'num_writebacks', 'direct_writeback')
+
+
+class Estimate(NamedTuple):
+    """
+    An extrapolated value and the half width of its confidence interval (inf when a single unit was sampled).
+    """
+    value: float
+    error: float
+
+    @property
+    def low(self):
+        return self.value - self.error
+
+    @property
+    def high(self):
+        return self.value + self.error
+
+    def __str__(self):
+        return "{:.6g} +/- {:.3g}".format(self.value, self.error)
+
+
+class SampledLevel(NamedTuple):
+    miss_rate: Estimate
+    misses: Estimate
+    writebacks: Estimate
+    memory_traffic: Estimate
+
+
+class SampledResult(NamedTuple):
+    """
+    The outcome of simulate_sampled(). l2 is None when the hierarchy has no L2.
+    """
+    config: Simulator.Config
+    units: int
+    sampled_units: int
+    sampled_references: int
+    l1: SampledLevel
+    l2: Optional[SampledLevel]
+    memory_traffic: Estimate
+
+
+class IntervalResult(NamedTuple):
+    """
+    The outcome of simulate_intervals(). l2 is None when the hierarchy has no L2.
+    """
+    config: Simulator.Config
+    windows: int
+    detailed_references: int
+    simulated_references: int
+    l1: SampledLevel
+    l2: Optional[SampledLevel]
+    memory_traffic: Estimate
+
+
+def choose_units(num_units, stride=DEFAULT_STRIDE, seed=None):
+    """
+    Picks one sampling unit in every stride: every stride-th unit, or with a seed, the same number
+    of units drawn at random without replacement.
+    :return: A sorted int array of unit numbers
+    """
+    count = max(1, num_units // stride)
+    if seed is None:
+        return np.arange(0, num_units, stride)[:count]
+    return np.sort(np.random.default_rng(seed).choice(num_units, size=count, replace=False))
+
+
+def sample_trace(trace, offset_bits, num_units, units):
+    """
+    Keeps the references whose block maps to one of the units, grouped by unit. Within a unit the
+    references keep their trace order, which is all the sets of the unit ever see.
+    :return: The filtered Trace, and the position in it at which each unit's references start,
+             with the end of the trace appended
+    """
+    addresses = np.asarray(trace.addresses, dtype=np.uint32)
+    unit = (addresses >> offset_bits) & (num_units - 1)
+    selected = np.zeros(num_units, dtype=bool)
+    selected[units] = True
+    positions = np.flatnonzero(selected[unit])
+    positions = positions[np.argsort(unit[positions], kind='stable')]
+    counts = np.bincount(unit[positions], minlength=num_units)[units]
+    starts = np.concatenate(([0], np.cumsum(counts)))
+    return Trace.Trace(np.asarray(trace.ops)[positions], addresses[positions], trace.path), starts
+
+
+def simulate_sampled(config, trace, stride=DEFAULT_STRIDE, seed=None):
+    """
+    Set sampling: simulates only the references that map to a subset of the cache sets, and
+    extrapolates the measurements of the whole hierarchy from them.
+    A sampling unit is one set of the level with the fewest sets. With a shared block size, every
+    block of a unit maps to sets of the other levels that hold nothing but blocks of that unit,
+    so each sampled set sees exactly the accesses, writebacks and back-invalidations it would see
+    in a full run, and only the choice of sets is an approximation. A hierarchy whose smallest
+    level has few sets therefore has few units, which shows as wide intervals.
+    Miss rates are ratio estimates and counts are expansion estimates over the units, both with
+    a finite population correction.
+    :param config: A Simulator.Config, or a tuple of its fields
+    :param trace: A Trace, or the path of a trace file
+    :param stride: Simulate one unit in every stride
+    :param seed: Draw the units at random with this seed instead of taking every stride-th one
+    :return: A SampledResult
+    """
+    config = Simulator.Config(*config).validate()
+    if not isinstance(trace, Trace.Trace):
+        trace = Trace.read_trace(trace)
+    l1_cache, l2_cache = Simulator.build_hierarchy(config)
+    caches = [l1_cache, l2_cache] if config.l2size else [l1_cache]
+    num_units = min(cache.num_of_sets for cache in caches)
+    units = choose_units(num_units, stride, seed)
+    sampled, starts = sample_trace(trace, l1_cache.number_of_offset_bits, num_units, units)
+    next_use = sampled.next_use(config.blocksize) if config.rep_pol == 2 else None
+
+    # The units share no sets, so they are simulated one after the other in the same caches and
+    # the counters are read between them
+    hierarchy = Hierarchy.Hierarchy(caches)
+    counts = np.empty((len(units), len(caches), len(COUNTERS)), dtype=np.int64)
+    for position, (start, stop) in enumerate(zip(starts[:-1], starts[1:])):
+        before = read_counters(caches)
+        hierarchy.run(sampled, next_use, start, stop)
+        counts[position] = read_counters(caches) - before
+
+    levels = estimate_levels(caches, counts, num_units)
+    return SampledResult(config=config, units=num_units, sampled_units=len(units), sampled_references=len(sampled),
+                         l1=levels[0], l2=levels[1] if config.l2size else None,
+                         memory_traffic=levels[-1].memory_traffic)
+
+
+def simulate_intervals(config, trace, detail=DEFAULT_DETAIL, warmup=DEFAULT_WARMUP,
+                       fast_forward=DEFAULT_FAST_FORWARD, warm_fast_forward=True):
+    """
+    Interval sampling: the trace is cut into periods of fast_forward, warmup and detail references.
+    Only the detailed windows are measured, and the miss rates and counts of the whole trace are
+    extrapolated from them, with the variance between windows giving the confidence intervals.
+    Warm-up windows are simulated in full but not measured, so that the detailed window starts
+    from a warm cache. Fast-forward regions are skipped, or with warm_fast_forward, functionally
+    warmed: only the last reference to each block in the region is simulated, in the order of
+    those references. This leaves an LRU L1 with the contents and recency order a full simulation
+    would, and marks the blocks written in the region as dirty; the other policies and the L2 are
+    only approximately warm.
+    :param config: A Simulator.Config, or a tuple of its fields
+    :param trace: A Trace, or the path of a trace file
+    :return: An IntervalResult
+    """
+    config = Simulator.Config(*config).validate()
+    if detail <= 0 or warmup < 0 or fast_forward < 0:
+        raise ValueError("The detailed windows must be longer than 0 and the other windows not negative")
+    if not isinstance(trace, Trace.Trace):
+        trace = Trace.read_trace(trace)
+    l1_cache, l2_cache = Simulator.build_hierarchy(config)
+    caches = [l1_cache, l2_cache] if config.l2size else [l1_cache]
+    next_use = trace.next_use(config.blocksize) if config.rep_pol == 2 else None
+    hierarchy = Hierarchy.Hierarchy(caches)
+
+    period = fast_forward + warmup + detail
+    counts = []
+    detailed = simulated = 0
+    for start in range(0, len(trace), period):
+        warmup_start = min(start + fast_forward, len(trace))
+        detail_start = min(warmup_start + warmup, len(trace))
+        stop = min(detail_start + detail, len(trace))
+        if warm_fast_forward and warmup_start > start:
+            simulated += _warm(hierarchy, trace, start, warmup_start, next_use)
+        hierarchy.run(trace, next_use, warmup_start, detail_start)
+        if stop > detail_start:
+            before = read_counters(caches)
+            hierarchy.run(trace, next_use, detail_start, stop)
+            counts.append(read_counters(caches) - before)
+        detailed += stop - detail_start
+        simulated += stop - warmup_start
+    if not counts:
+        raise ValueError("The trace is shorter than the first detailed window")
+
+    levels = estimate_levels(caches, np.array(counts), max(len(trace) // detail, len(counts)))
+    return IntervalResult(config=config, windows=len(counts), detailed_references=detailed,
+                          simulated_references=simulated, l1=levels[0], l2=levels[1] if config.l2size else None,
+                          memory_traffic=levels[-1].memory_traffic)
+
+
+def _warm(hierarchy, trace, start, stop, next_use):
+    """
+    Functional warming of a fast-forward region, see simulate_intervals.
+    :return: The number of references simulated
+    """
+    offset_bits = hierarchy.caches[0].number_of_offset_bits
+    addresses = np.asarray(trace.addresses[start:stop], dtype=np.uint32)
+    blocks, first_from_end, inverse = np.unique((addresses >> offset_bits)[::-1], return_index=True,
+                                                return_inverse=True)
+    written = np.zeros(len(blocks), dtype=np.uint8)
+    np.maximum.at(written, inverse, np.asarray(trace.ops[start:stop], dtype=np.uint8)[::-1])
+    order = np.argsort(first_from_end)[::-1]  # the blocks by their last reference in the region
+    positions = len(addresses) - 1 - first_from_end[order]
+    warming = Trace.Trace(written[order], addresses[positions])
+    hierarchy.run(warming, None if next_use is None else np.asarray(next_use[start:stop])[positions])
+    return len(warming)
+
+
+def read_counters(caches):
+    """
+    :return: An int array of the COUNTERS of every cache, one row per cache
+    """
+    return np.array([[cache.measurements[name] for name in COUNTERS] for cache in caches], dtype=np.int64)
+
+
+def estimate_levels(caches, counts, population):
+    """
+    Extrapolates the measurements of every level from the counters of the sampled units or windows.
+    :param counts: The counter deltas of each sample, shaped (samples, levels, COUNTERS)
+    :param population: The number of samples that make up the whole trace
+    :return: A list of SampledLevel, L1 first
+    """
+    levels = []
+    for level, cache in enumerate(caches):
+        reads, reads_miss, writes, writes_miss, writebacks, _ = counts[:, level].T
+        if level == 0:
+            accesses, misses = reads + writes, reads_miss + writes_miss
+        else:
+            accesses, misses = reads, reads_miss
+        traffic = reads_miss + writes_miss + writebacks
+        if level and cache.inclusion_property == 1:
+            traffic = traffic + counts[:, :level, COUNTERS.index('direct_writeback')].sum(axis=1)
+        levels.append(SampledLevel(miss_rate=ratio_estimate(misses, accesses, population),
+                                   misses=total_estimate(reads_miss + writes_miss, population),
+                                   writebacks=total_estimate(writebacks, population),
+                                   memory_traffic=total_estimate(traffic, population)))
+    return levels
+
+
+def ratio_estimate(numerators, denominators, population):
+    """
+    :return: The Estimate of sum(numerators) / sum(denominators) over the whole population of units
+    """
+    n = len(numerators)
+    total = denominators.sum()
+    if not total:
+        return Estimate(0.0, math.inf)
+    ratio = numerators.sum() / total
+    if n < 2:
+        return Estimate(ratio, math.inf)
+    residuals = numerators - ratio * denominators
+    variance = (1 - n / population) * residuals.var(ddof=1) / (n * (total / n) ** 2)
+    return Estimate(ratio, CONFIDENCE_Z * math.sqrt(variance))
+
+
+def total_estimate(values, population):
+    """
+    :return: The Estimate of the sum of values over the whole population of units
+    """
+    n = len(values)
+    value = population * values.mean()
+    if n < 2:
+        return Estimate(value, math.inf)
+    variance = population ** 2 * (1 - n / population) * values.var(ddof=1) / n
+    return Estimate(value, CONFIDENCE_Z * math.sqrt(variance))
+
+
+def sampled_sweep(trace, configs, stride=DEFAULT_STRIDE, seed=None):
+    """
+    simulate_sampled over every configuration of a sweep, reading the trace once.
+    :return: A list of SampledResult in the order of configs
+    """
+    if not isinstance(trace, Trace.Trace):
+        trace = Trace.read_trace(trace)
+    return [simulate_sampled(config, trace, stride, seed) for config in configs]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estimates the results of a hierarchy by set or interval sampling.")
+    parser.add_argument("config", nargs=7, type=int,
+                        help="blocksize l1size l1assoc l2size l2assoc rep_pol inc_pol, as for main.py")
+    parser.add_argument("trace_file")
+    parser.add_argument("--stride", type=int, default=DEFAULT_STRIDE, help="simulate one unit in every STRIDE")
+    parser.add_argument("--seed", type=int, help="draw the units at random with this seed")
+    parser.add_argument("--intervals", action="store_true", help="sample windows of the trace instead of sets")
+    parser.add_argument("--detail", type=int, default=DEFAULT_DETAIL, help="references per detailed window")
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP, help="references per warm-up window")
+    parser.add_argument("--fast-forward", type=int, default=DEFAULT_FAST_FORWARD,
+                        help="references per fast-forward region")
+    parser.add_argument("--skip", action="store_true", help="skip the fast-forward regions instead of warming them")
+    parser.add_argument("--exact", action="store_true", help="also run the full simulation and report the errors")
+    args = parser.parse_args(argv)
+
+    trace = Trace.read_trace(args.trace_file)
+    start = time.perf_counter()
+    if args.intervals:
+        result = simulate_intervals(args.config, trace, args.detail, args.warmup, args.fast_forward, not args.skip)
+        sampled_time = time.perf_counter() - start
+        print("{} windows, {} detailed and {} simulated of {} references, {:.3f} s".format(
+            result.windows, result.detailed_references, result.simulated_references, len(trace), sampled_time))
+    else:
+        result = simulate_sampled(args.config, trace, args.stride, args.seed)
+        sampled_time = time.perf_counter() - start
+        print("{} of {} units, {} of {} references, {:.3f} s".format(
+            result.sampled_units, result.units, result.sampled_references, len(trace), sampled_time))
+    if args.exact:
+        start = time.perf_counter()
+        exact = Simulator.simulate(args.config, trace)
+        exact_time = time.perf_counter() - start
+        print("full simulation {:.3f} s, {:.1f}x the sampled time".format(exact_time, exact_time / sampled_time))
+    for name in ('l1', 'l2'):
+        level = getattr(result, name)
+        if level is None:
+            continue
+        for field, estimate in level._asdict().items():
+            line = "{} {}: {}".format(name.upper(), field, estimate)
+            if args.exact:
+                stats = getattr(exact, name)
+                actual = {'miss_rate': stats.miss_rate, 'misses': stats.read_misses + stats.write_misses,
+                          'writebacks': stats.writebacks, 'memory_traffic': stats.memory_traffic}[field]
+                line += " (exact {:.6g}, error {:+.3g})".format(actual, estimate.value - actual)
+            print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    # python Sampling.py <blocksize> <l1size> <l1assoc> <l2size> <l2assoc> <rep_pol> <inc_pol> <trace_file>
+    #                    [--stride 16] [--seed S] [--exact]
+    #                    [--intervals [--detail 1000] [--warmup 2000] [--fast-forward 7000] [--skip]]
+    sys.exit(main())
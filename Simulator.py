@@ -0,0 +1,257 @@
+import contextlib
+import os
+import sys
+import tempfile
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import Cache
+import Hierarchy
+import MissClasses
+import Trace
+
+REPLACEMENT_POLICIES = ('LRU', 'Pseudo-LRU', 'Optimal')
+INCLUSION_PROPERTIES = ('non-inclusive', 'inclusive')
+
+
+class Config(NamedTuple):
+    """
+    A two level hierarchy, in the order of the main.py arguments. An l2size of 0 means no L2.
+    rep_pol is 0 for LRU, 1 for PLRU and 2 for Optimal; inc_pol is 0 for non-inclusive and 1 for inclusive.
+    """
+    blocksize: int
+    l1size: int
+    l1assoc: int
+    l2size: int = 0
+    l2assoc: int = 0
+    rep_pol: int = 0
+    inc_pol: int = 0
+
+    def validate(self):
+        """
+        :return: The config, if every cache has a power of two block size and number of sets
+        :raises ValueError: Otherwise
+        """
+        levels = [Hierarchy.Level(self.l1size, self.l1assoc, self.rep_pol, self.inc_pol)]
+        if self.l2size:
+            levels.append(Hierarchy.Level(self.l2size, self.l2assoc, self.rep_pol, self.inc_pol))
+        validate_levels(self.blocksize, levels)
+        return self
+
+
+def validate_levels(blocksize, levels):
+    """
+    :raises ValueError: Unless every level has a known policy and a power of two number of sets
+                        of a power of two block size
+    """
+    if not _is_power_of_two(blocksize):
+        raise ValueError("The block size must be a power of two, got {}".format(blocksize))
+    for position, level in enumerate(levels, 1):
+        if level.rep_pol not in range(len(REPLACEMENT_POLICIES)):
+            raise ValueError("Unknown replacement policy {}".format(level.rep_pol))
+        if level.inc_pol not in range(len(INCLUSION_PROPERTIES)):
+            raise ValueError("Unknown inclusion property {}".format(level.inc_pol))
+        size, assoc = level.size, level.assoc
+        if assoc <= 0 or size % (assoc * blocksize) or not _is_power_of_two(size // (assoc * blocksize)):
+            raise ValueError("The L{} size {} is not a power of two number of {}-way sets of {} byte blocks"
+                             .format(position, size, assoc, blocksize))
+
+
+def _is_power_of_two(n):
+    return n > 0 and n & (n - 1) == 0
+
+
+class LevelStats(NamedTuple):
+    """
+    The measurements of one cache level at the end of a simulation.
+    """
+    reads: int
+    read_misses: int
+    writes: int
+    write_misses: int
+    miss_rate: float
+    writebacks: int
+    memory_traffic: int
+    direct_writebacks: int
+
+    @classmethod
+    def from_cache(cls, cache):
+        measurements = cache.measurements
+        return cls(reads=measurements['reads'], read_misses=measurements['reads_miss'],
+                   writes=measurements['writes'], write_misses=measurements['writes_miss'],
+                   miss_rate=float(measurements['miss_rate']), writebacks=measurements['num_writebacks'],
+                   memory_traffic=measurements['memory_traffic'],
+                   direct_writebacks=measurements['direct_writeback'])
+
+
+class Result(NamedTuple):
+    """
+    The outcome of simulate(). l2 is None when the hierarchy has no L2.
+    The caches themselves are kept for their final contents (Cache.display_cache_content,
+    Cache.get_state_arrays) and their raw measurements dicts.
+    miss_classifiers holds a MissClasses.MissClassifier per level when simulate() classified the misses.
+    """
+    config: Config
+    l1: LevelStats
+    l2: Optional[LevelStats]
+    memory_traffic: int
+    l1_cache: Cache.Cache
+    l2_cache: Cache.Cache
+    miss_classifiers: Optional[List[MissClasses.MissClassifier]] = None
+
+
+class HierarchyResult(NamedTuple):
+    """
+    The outcome of simulate_levels(): the stats and final caches of every level, L1 first.
+    """
+    blocksize: int
+    levels: Tuple[Hierarchy.Level, ...]
+    stats: Tuple[LevelStats, ...]
+    memory_traffic: int
+    caches: Tuple[Cache.Cache, ...]
+
+
+def build_hierarchy(config):
+    """
+    Creates the L1 and L2 caches for a configuration. The L2 is an empty cache when l2size is 0.
+    :return: l1 cache, l2 cache
+    """
+    l1_class = Cache.cache_class(config.rep_pol, config.l1size, config.l1assoc, config.blocksize)
+    l2_class = Cache.cache_class(config.rep_pol, config.l2size, config.l2assoc, config.blocksize)
+    l1_cache = l1_class(size=config.l1size, associativity=config.l1assoc, inclusion_property=config.inc_pol,
+                        replacement_policy=config.rep_pol, block_size=config.blocksize, is_highest=True, name="L1")
+    l2_cache = l2_class(size=config.l2size, associativity=config.l2assoc, inclusion_property=config.inc_pol,
+                        replacement_policy=config.rep_pol, block_size=config.blocksize, is_highest=False, name="L2")
+    return l1_cache, l2_cache
+
+
+def finalize(l1_cache, l2_cache):
+    """
+    Computes the miss rates and memory traffic of a simulated hierarchy into its measurements.
+    :return: NONE
+    """
+    l1_cache.getMissRate(1)
+    l2_cache.getMissRate(2)
+    l1_cache.getMemoryTraffic(1, 0)
+    l2_cache.getMemoryTraffic(2, l1_cache.measurements['direct_writeback'])
+
+
+def load_trace(path, stream=False):
+    """
+    Loads a trace file, either a text trace or a packed trace created by Trace.py.
+    Packed traces are memory-mapped instead of being parsed.
+    When streaming, text traces are parsed in large blocks as the simulation consumes them;
+    stdin ('-') and .gz/.xz files are always streamed.
+    :return: A Trace
+    """
+    if Trace.is_streamed_trace(path) or (stream and not Trace.is_packed_trace(path)):
+        return Trace.TraceStream(path)
+    return Trace.read_trace(path)
+
+
+def simulate(config: Union[Config, tuple], trace: Union[Trace.Trace, str], next_use=None,
+             out_of_core: bool = False, classify_misses: bool = False) -> Result:
+    """
+    Simulates a hierarchy over a trace.
+    :param config: A Config, or a tuple of its fields
+    :param trace: A Trace, or the path of a trace file loaded with load_trace
+    :param next_use: The trace's next-use array for the config's block size (see Trace.next_use).
+                     Only used by the Optimal policy, which computes it when it is not given.
+    :param out_of_core: Keep the computed next-use array in a temporary file instead of in memory
+    :param classify_misses: Also classify the misses of every level as compulsory, capacity or conflict
+    :return: The Result
+    :raises ValueError: For an invalid config, or the Optimal policy on a streamed trace
+    """
+    config = Config(*config).validate()
+    if not isinstance(trace, Trace.Trace):
+        trace = load_trace(trace)
+    l1_cache, l2_cache = build_hierarchy(config)
+    caches = [l1_cache, l2_cache] if config.l2size else [l1_cache]
+    classifiers = MissClasses.attach(caches) if classify_misses else None
+    try:
+        _run(Hierarchy.Hierarchy(caches), config.blocksize, config.rep_pol == 2, trace, next_use, out_of_core)
+    finally:
+        for classifier in classifiers or ():
+            classifier.detach()
+    return collect_result(config, l1_cache, l2_cache)._replace(miss_classifiers=classifiers)
+
+
+def collect_result(config, l1_cache, l2_cache):
+    """
+    Finalizes the caches of a simulated hierarchy, see finalize.
+    :return: The Result
+    """
+    finalize(l1_cache, l2_cache)
+    return Result(config=config, l1=LevelStats.from_cache(l1_cache),
+                  l2=LevelStats.from_cache(l2_cache) if config.l2size else None,
+                  memory_traffic=(l2_cache if config.l2size else l1_cache).measurements['memory_traffic'],
+                  l1_cache=l1_cache, l2_cache=l2_cache)
+
+
+def simulate_levels(blocksize: int, levels: Sequence[Union[Hierarchy.Level, tuple]],
+                    trace: Union[Trace.Trace, str], next_use=None, out_of_core: bool = False) -> HierarchyResult:
+    """
+    Simulates a hierarchy of any number of levels, each with its own size, associativity,
+    replacement policy and inclusion property.
+    :param blocksize: The block size shared by every level
+    :param levels: Hierarchy.Level, or tuples of its fields, L1 first
+    :param trace: A Trace, or the path of a trace file loaded with load_trace
+    :param next_use: As for simulate, used by the levels with the Optimal policy
+    :param out_of_core: As for simulate
+    :return: The HierarchyResult
+    :raises ValueError: For an invalid level, or the Optimal policy on a streamed trace
+    """
+    levels = tuple(Hierarchy.Level(*level) for level in levels)
+    if not levels:
+        raise ValueError("A hierarchy needs at least one level")
+    validate_levels(blocksize, levels)
+    if not isinstance(trace, Trace.Trace):
+        trace = load_trace(trace)
+    hierarchy = Hierarchy.Hierarchy(Hierarchy.build_caches(blocksize, levels))
+    _run(hierarchy, blocksize, any(level.rep_pol == 2 for level in levels), trace, next_use, out_of_core)
+
+    hierarchy.finalize()
+    return HierarchyResult(blocksize=blocksize, levels=levels,
+                           stats=tuple(LevelStats.from_cache(cache) for cache in hierarchy.caches),
+                           memory_traffic=hierarchy.memory_traffic(), caches=tuple(hierarchy.caches))
+
+
+def _run(hierarchy, blocksize, needs_next_use, trace, next_use, out_of_core):
+    if needs_next_use and next_use is None:
+        with next_use_array(trace, blocksize, out_of_core) as next_use:
+            hierarchy.run(trace, next_use)
+    else:
+        hierarchy.run(trace, next_use if needs_next_use else None)
+
+
+@contextlib.contextmanager
+def next_use_array(trace, blocksize, out_of_core=False):
+    """
+    Computes the next-use array of a trace for the Optimal policy, in memory or, out of core,
+    in a temporary file that is removed when the context exits.
+    :raises ValueError: If the trace is a stream
+    """
+    if isinstance(trace, Trace.TraceStream):
+        raise ValueError("The Optimal policy needs the whole trace and cannot be run on a stream")
+    if not out_of_core:
+        yield trace.next_use(blocksize)
+        return
+    fd, next_use_file = tempfile.mkstemp(suffix=".npy", prefix="next_use_")
+    os.close(fd)
+    try:
+        yield trace.write_next_use(blocksize, next_use_file)
+    finally:
+        os.remove(next_use_file)
+
+
+if __name__ == "__main__":
+    # python Simulator.py <blocksize> <size>,<assoc>,<rep_pol>,<inc_pol> [<size>,<assoc>,<rep_pol>,<inc_pol> ...] <trace_file>
+    # Simulates a hierarchy of any depth, one comma separated level per argument, L1 first
+    hierarchy_result = simulate_levels(int(sys.argv[1]), [[int(x) for x in arg.split(",")] for arg in sys.argv[2:-1]],
+                                       sys.argv[-1])
+    for position, (level_config, stats) in enumerate(zip(hierarchy_result.levels, hierarchy_result.stats), 1):
+        print("L{}: {} bytes, {}-way, {}, {}".format(position, level_config.size, level_config.assoc,
+                                                   REPLACEMENT_POLICIES[level_config.rep_pol],
+                                                   INCLUSION_PROPERTIES[level_config.inc_pol]))
+        for name, value in stats._asdict().items():
+            print("   {}: {}".format(name, value))
+    print("memory traffic:", hierarchy_result.memory_traffic)
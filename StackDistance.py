@@ -0,0 +1,217 @@
+import math
+import sys
+
+import numpy as np
+
+import Cache
+import Trace
+
+
+class FenwickTree:
+    """
+    Binary indexed tree over n counters with O(log n) point updates and prefix sums.
+    """
+
+    def __init__(self, n):
+        self.tree = [0] * (n + 1)
+
+    def add(self, position, delta):
+        tree = self.tree
+        position += 1
+        while position < len(tree):
+            tree[position] += delta
+            position += position & -position
+
+    def prefix_sum(self, position):
+        """
+        :return: The sum of the counters at positions 0 .. position - 1
+        """
+        tree = self.tree
+        total = 0
+        while position > 0:
+            total += tree[position]
+            position -= position & -position
+        return total
+
+
+def lru_stack_distances(trace, block_size, num_of_sets):
+    """
+    Computes the LRU stack distance of every reference in one pass (Mattson et al.): the number of
+    distinct blocks of the same set referenced since the previous reference to its block.
+    A reference hits in an LRU cache with num_of_sets sets of associativity A iff its distance is below A.
+
+    The references are laid out set by set in trace order, so one Fenwick tree covers every set.
+    It holds a 1 at the latest reference of each block, and the distance of a reference is the
+    count of 1s between the previous reference to its block and itself.
+    :return: An int64 array aligned with the trace, -1 for the first reference to a block
+    """
+    number_of_offset_bits = int(math.log(block_size, 2))
+    number_of_index_bits = int(math.log(num_of_sets, 2))
+    index, tag = Cache.decode_addresses(trace.addresses, number_of_offset_bits, number_of_index_bits)
+    slots = np.empty(len(trace), dtype=np.int64)
+    slots[np.argsort(index, kind='stable')] = np.arange(len(trace))
+
+    blocks = (tag.astype(np.int64) << number_of_index_bits) | index
+    distances = []
+    fenwick = FenwickTree(len(trace))
+    last_slot = {}
+    for block, slot in zip(blocks.tolist(), slots.tolist()):
+        previous = last_slot.get(block)
+        if previous is None:
+            distances.append(-1)
+        else:
+            distances.append(fenwick.prefix_sum(slot) - fenwick.prefix_sum(previous + 1))
+            fenwick.add(previous, -1)
+        fenwick.add(slot, 1)
+        last_slot[block] = slot
+    return np.array(distances, dtype=np.int64)
+
+
+def opt_stack_distances(trace, block_size, num_of_sets, max_assoc, next_use=None):
+    """
+    Computes the Optimal stack distance of every reference in one pass. Belady's policy is a stack
+    algorithm too (Mattson et al.) whose priority is the next use of a block: the first A entries of
+    the priority stack of a set are the blocks held by an Optimal cache of associativity A.
+    A referenced block moves to the top, and the blocks above its old position are pushed down: at each
+    position the block used later, which the cache of that many ways evicts, moves on and the other stays.
+    Only the first max_assoc entries of each stack are kept, which is exact up to that associativity.
+    A reference hits in an Optimal cache with num_of_sets sets of associativity A iff its distance is below A.
+    :param next_use: The next-use array of the trace (see Trace.next_use), computed when not given
+    :return: An int64 array aligned with the trace, -1 for the first reference to a block and
+             max_assoc for a block deeper than max_assoc
+    """
+    if next_use is None:
+        next_use = trace.next_use(block_size)
+    number_of_offset_bits = int(math.log(block_size, 2))
+    number_of_index_bits = int(math.log(num_of_sets, 2))
+    index, tag = Cache.decode_addresses(trace.addresses, number_of_offset_bits, number_of_index_bits)
+    blocks = (tag.astype(np.int64) << number_of_index_bits) | index
+
+    stacks = [[] for _ in range(num_of_sets)]  # blocks of every set, highest priority first
+    stack_next_uses = [[] for _ in range(num_of_sets)]
+    seen = set()
+    distances = []
+    for set_index, block, block_next_use in zip(index.tolist(), blocks.tolist(), np.asarray(next_use).tolist()):
+        stack = stacks[set_index]
+        next_uses = stack_next_uses[set_index]
+        try:
+            depth = stack.index(block)
+            distances.append(depth)
+        except ValueError:
+            depth = len(stack)
+            distances.append(max_assoc if block in seen else -1)
+            seen.add(block)
+            if depth < max_assoc:
+                stack.append(block)
+                next_uses.append(block_next_use)
+        if depth == 0:
+            next_uses[0] = block_next_use
+            continue
+        carry_block, carry_next_use = stack[0], next_uses[0]
+        stack[0], next_uses[0] = block, block_next_use
+        for position in range(1, min(depth, max_assoc)):
+            if next_uses[position] > carry_next_use:
+                stack[position], carry_block = carry_block, stack[position]
+                next_uses[position], carry_next_use = carry_next_use, next_uses[position]
+        if depth < max_assoc:
+            stack[depth], next_uses[depth] = carry_block, carry_next_use
+    return np.array(distances, dtype=np.int64)
+
+
+def distance_curve(trace, distances, block_size, num_of_sets, max_assoc):
+    """
+    Turns per-reference stack distances into miss counts for every associativity up to max_assoc.
+    A reference misses at associativity A iff it is a first reference (distance -1) or its distance is at least A.
+    :return: A list with one measurements dict per associativity 1 .. max_assoc, holding the same
+             read/write counts and formatted miss rate as Cache.measurements plus 'assoc' and 'size'
+    """
+    writes = np.asarray(trace.ops) == Trace.OP_WRITE
+    capped = np.where(distances < 0, max_assoc, np.minimum(distances, max_assoc))
+    read_hist = np.bincount(capped[~writes], minlength=max_assoc + 1)
+    write_hist = np.bincount(capped[writes], minlength=max_assoc + 1)
+    # misses at associativity A are the references with capped distance >= A
+    read_misses = np.cumsum(read_hist[::-1])[::-1]
+    write_misses = np.cumsum(write_hist[::-1])[::-1]
+    reads = int(read_hist.sum())
+    writes = int(write_hist.sum())
+
+    curve = []
+    for assoc in range(1, max_assoc + 1):
+        measurements = {
+            "assoc": assoc,
+            "size": assoc * num_of_sets * block_size,
+            "reads": reads,
+            "reads_miss": int(read_misses[assoc]),
+            "writes": writes,
+            "writes_miss": int(write_misses[assoc]),
+        }
+        miss_rate = (measurements['reads_miss'] + measurements['writes_miss']) / (reads + writes)
+        measurements['miss_rate'] = '{:.6f}'.format(miss_rate)
+        curve.append(measurements)
+    return curve
+
+
+def miss_ratio_curve(trace, block_size, num_of_sets, max_assoc):
+    """
+    LRU miss counts of every cache with num_of_sets sets and associativity 1 .. max_assoc,
+    from a single traversal of the trace.
+    """
+    distances = lru_stack_distances(trace, block_size, num_of_sets)
+    return distance_curve(trace, distances, block_size, num_of_sets, max_assoc)
+
+
+def opt_miss_ratio_curve(trace, block_size, num_of_sets, max_assoc, next_use=None):
+    """
+    Optimal miss counts of every cache with num_of_sets sets and associativity 1 .. max_assoc,
+    from a single traversal of the trace. Subtracting them from the miss_ratio_curve of the same
+    caches gives the optimality gap of LRU.
+    """
+    distances = opt_stack_distances(trace, block_size, num_of_sets, max_assoc, next_use)
+    return distance_curve(trace, distances, block_size, num_of_sets, max_assoc)
+
+
+def lru_miss_rates(trace, configs):
+    """
+    L1 LRU miss rates of many (blocksize, l1size, l1assoc) configurations.
+    Configurations with the same block size and number of sets share one stack distance pass.
+    :return: The miss rates as formatted by Cache.getMissRate, in the order of configs
+    """
+    return _miss_rates(trace, configs, miss_ratio_curve)
+
+
+def opt_miss_rates(trace, configs):
+    """
+    The L1 Optimal miss rates of configurations, as lru_miss_rates.
+    """
+    next_uses = {}
+
+    def curve(trace, block_size, num_of_sets, max_assoc):
+        if block_size not in next_uses:
+            next_uses[block_size] = trace.next_use(block_size)
+        return opt_miss_ratio_curve(trace, block_size, num_of_sets, max_assoc, next_uses[block_size])
+    return _miss_rates(trace, configs, curve)
+
+
+def _miss_rates(trace, configs, curve_function):
+    groups = {}
+    for blocksize, l1size, l1assoc in configs:
+        num_of_sets = l1size // (l1assoc * blocksize)
+        groups[(blocksize, num_of_sets)] = max(groups.get((blocksize, num_of_sets), 0), l1assoc)
+    curves = {}
+    for (blocksize, num_of_sets), max_assoc in groups.items():
+        curves[(blocksize, num_of_sets)] = curve_function(trace, blocksize, num_of_sets, max_assoc)
+    return [curves[(blocksize, l1size // (l1assoc * blocksize))][l1assoc - 1]['miss_rate']
+            for blocksize, l1size, l1assoc in configs]
+
+
+if __name__ == "__main__":
+    # python StackDistance.py <BLOCKSIZE> <NUM_OF_SETS> <MAX_ASSOC> <trace_file>
+    # Prints the LRU miss ratio curve, then the Optimal misses and the gap between the two miss rates
+    arguments = (Trace.read_trace(sys.argv[4]), int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]))
+    curve = miss_ratio_curve(*arguments)
+    opt_curve = opt_miss_ratio_curve(*arguments)
+    print("assoc size reads reads_miss writes writes_miss miss_rate opt_reads_miss opt_writes_miss opt_miss_rate gap")
+    for point, opt_point in zip(curve, opt_curve):
+        print(point['assoc'], point['size'], point['reads'], point['reads_miss'], point['writes'],
+              point['writes_miss'], point['miss_rate'], opt_point['reads_miss'], opt_point['writes_miss'],
+              opt_point['miss_rate'], '{:.6f}'.format(float(point['miss_rate']) - float(opt_point['miss_rate'])))
@@ -0,0 +1,164 @@
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+import Simulator
+import Trace
+
+# The configurations of a sweep are Simulator configurations
+SweepConfig = Simulator.Config
+
+
+def run_config(trace, config, next_use=None, contents=False):
+    """
+    Simulates one configuration over an already loaded trace with Simulator.simulate.
+    next_use is only needed for the Optimal policy and is computed from the trace when not given.
+    :return: A dict with the config and the final 'l1' and 'l2' measurements, see collect_results
+    """
+    result = Simulator.simulate(config, trace, next_use)
+    return collect_results(result.config, result.l1_cache, result.l2_cache, contents)
+
+
+def collect_results(config, l1_cache, l2_cache, contents=False):
+    """
+    Finalizes the miss rates and memory traffic of a simulated hierarchy.
+    :param contents: Also keep the final cache contents, as copies of Cache.get_state_arrays()
+    :return: A dict with the config and the final 'l1' and 'l2' measurements, and with contents
+             a 'contents' dict of the 'l1' and 'l2' state arrays (None for an absent L2)
+    """
+    Simulator.finalize(l1_cache, l2_cache)
+    result = {'config': config, 'l1': l1_cache.measurements, 'l2': l2_cache.measurements}
+    if contents:
+        result['contents'] = {
+            'l1': {name: column.copy() for name, column in l1_cache.get_state_arrays().items()},
+            'l2': {name: column.copy() for name, column in l2_cache.get_state_arrays().items()}
+            if l2_cache.size else None,
+        }
+    return result
+
+
+def run_sweep(trace, configs, verbose=False, contents=False):
+    """
+    Runs every configuration in one process. The trace is read once and the Optimal policy's
+    next-use array is computed once per block size. Addresses are decoded a chunk at a time by
+    each run, so that nothing the size of the trace is kept per cache geometry. The vectorized chunk
+    decoding is a fraction of a percent of a run; most of what --instrument reports as "decode" is
+    the per-access decoding of writebacks and back-invalidations, which a whole-trace decoding
+    would not save.
+    :param trace: A Trace or the path of a text or packed trace file
+    :param configs: An iterable of SweepConfig or of plain
+                    (blocksize, l1size, l1assoc, l2size, l2assoc, rep_pol, inc_pol) tuples
+    :param contents: Keep the final cache contents in each result, see collect_results
+    :return: A list of result dicts from run_config, in the order of configs
+    """
+    if not isinstance(trace, Trace.Trace):
+        trace = Trace.read_trace(trace)
+    next_uses = {}
+    results = []
+    for config in configs:
+        config = SweepConfig(*config)
+        next_use = None
+        if config.rep_pol == 2:
+            if config.blocksize not in next_uses:
+                next_uses[config.blocksize] = trace.next_use(config.blocksize)
+            next_use = next_uses[config.blocksize]
+        results.append(run_config(trace, config, next_use, contents))
+        if verbose:
+            print(config, "L1 miss rate:", results[-1]['l1']['miss_rate'],
+                  "L2 miss rate:", results[-1]['l2']['miss_rate'])
+    return results
+
+
+# Per worker process state: the packed trace the worker is on, memory-mapped, and its next-use arrays
+# by block size. Moving to another trace drops both, so a worker never holds more than one trace's.
+_worker_path = None
+_worker_trace = None
+_worker_next_uses = {}
+
+
+def _load_worker_trace(path):
+    global _worker_path, _worker_trace
+    if path != _worker_path:
+        _worker_next_uses.clear()
+        _worker_path, _worker_trace = path, Trace.load_trace(path)
+    return _worker_trace
+
+
+def _run_job(job):
+    position, path, config, contents = job
+    trace = _load_worker_trace(path)
+    next_use = None
+    if config.rep_pol == 2:
+        if config.blocksize not in _worker_next_uses:
+            _worker_next_uses[config.blocksize] = trace.next_use(config.blocksize)
+        next_use = _worker_next_uses[config.blocksize]
+    return position, run_config(trace, config, next_use, contents)
+
+
+def run_parallel_sweep(trace_files, configs, processes=None, progress=True, contents=False):
+    """
+    Runs every configuration over every trace on a pool of worker processes.
+    Text traces are first packed into a temporary directory, so that the workers memory-map the
+    same file and share its pages instead of each receiving a copy of the trace.
+    :param trace_files: A trace file path or a list of them, text or packed
+    :param configs: The configurations, as accepted by run_sweep
+    :param processes: Number of worker processes, all cores by default
+    :param progress: Report each finished configuration on stderr
+    :param contents: Keep the final cache contents in each result, see collect_results
+    :return: A list of result dicts from run_config with an added 'trace' entry,
+             ordered by trace and then by configuration whatever order the workers finish in
+    """
+    if isinstance(trace_files, str):
+        trace_files = [trace_files]
+    configs = [SweepConfig(*config) for config in configs]
+    packed_dir = tempfile.mkdtemp(prefix="sweep_")
+    try:
+        packed_files = []
+        for trace_file in trace_files:
+            if Trace.is_packed_trace(trace_file):
+                packed_files.append(trace_file)
+            else:
+                packed_file = os.path.join(packed_dir, "{}_{}".format(len(packed_files), os.path.basename(trace_file)))
+                packed_files.append(Trace.convert_tracefile(trace_file, packed_file))
+
+        jobs = []
+        for trace_file, packed_file in zip(trace_files, packed_files):
+            for config in configs:
+                jobs.append((len(jobs), packed_file, config, contents))
+        results = [None] * len(jobs)
+        with multiprocessing.Pool(processes) as pool:
+            for done, (position, result) in enumerate(pool.imap_unordered(_run_job, jobs), 1):
+                result['trace'] = trace_files[position // len(configs)]
+                results[position] = result
+                if progress:
+                    print("[{}/{}] {} {} L1 miss rate: {}".format(done, len(jobs), os.path.basename(result['trace']),
+                                                                 tuple(result['config']), result['l1']['miss_rate']),
+                          file=sys.stderr)
+        return results
+    finally:
+        shutil.rmtree(packed_dir, ignore_errors=True)
+
+
+def l1_grid(blocksize=32, sizes=tuple(2 ** x for x in range(10, 21)), assocs=(1, 2, 4, 8, "full"), rep_pols=(0, 1, 2)):
+    """
+    The L1-only design space of Graphs 1-3: every replacement policy, size and associativity.
+    "full" associativity is a single set holding the whole cache.
+    :return: A list of SweepConfig
+    """
+    configs = []
+    for rep_pol in rep_pols:
+        for assoc in assocs:
+            for size in sizes:
+                l1assoc = size // blocksize if assoc == "full" else assoc
+                configs.append(SweepConfig(blocksize, size, l1assoc, 0, 0, rep_pol, 0))
+    return configs
+
+
+if __name__ == "__main__":
+    # python Sweep.py <trace_file> [<trace_file> ...]
+    # Runs the L1 grid over every trace file in parallel and prints the miss rates
+    grid = l1_grid()
+    for sweep_result in run_parallel_sweep(sys.argv[1:], grid):
+        print(sweep_result['trace'], *sweep_result['config'], sweep_result['l1']['miss_rate'])
@@ -0,0 +1,296 @@
+import array
+import gzip
+import itertools
+import lzma
+import math
+import os
+import struct
+import sys
+
+import numpy as np
+
+# Packed trace layout: a 16 byte header followed by the ops column (uint8, one per reference),
+# zero padding up to a 4 byte boundary and the addresses column (little endian uint32).
+TRACE_MAGIC = b'CTRC'
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('<4sIQ')
+PACKED_EXTENSION = '.trc'
+
+OP_READ = 0
+OP_WRITE = 1
+OP_CODES = ('r', 'w')
+
+CHUNK_SIZE = 1 << 16
+STREAM_BUFFER_SIZE = 1 << 20
+NEXT_USE_CHUNK_SIZE = 1 << 22
+UTF8_BOM = b'\xef\xbb\xbf'
+
+
+class Trace:
+    """
+    A memory trace held as two parallel columns instead of a list of ['r', '40051a00'] lists.
+    ops is a uint8 array (0 for read, 1 for write) and addresses is a uint32 array.
+    Both columns can be memory-mapped views of a packed trace file.
+    """
+
+    def __init__(self, ops, addresses, path=""):
+        if len(ops) != len(addresses):
+            raise ValueError("ops and addresses must have the same length")
+        self.ops = ops
+        self.addresses = addresses
+        self.path = path
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __iter__(self):
+        """
+        Yields every reference as an ('r'/'w', address) tuple.
+        The columns are converted a chunk at a time so that the trace is never expanded in memory.
+        """
+        for ops, addresses in self.chunks():
+            for op, address in zip(ops.tolist(), addresses.tolist()):
+                yield OP_CODES[op], address
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """
+        :return: A generator over (ops, addresses) slices of at most chunk_size references.
+        """
+        for start in range(0, len(self), chunk_size):
+            yield self.ops[start:start + chunk_size], self.addresses[start:start + chunk_size]
+
+    def decoded(self, *caches, next_use=None):
+        """
+        Like iterating the trace, but each reference also carries its precomputed index and tag
+        for every cache given, decoded a chunk at a time with Cache.decode_addresses. Decoding one
+        chunk costs far less than simulating it, so nothing is kept between runs.
+        If a next_use array is given, each reference's next use follows the instruction.
+        :return: A generator over (instruction, [next_use,] index_1, tag_1, index_2, tag_2, ...) tuples
+        """
+        start = 0
+        for ops, addresses in self.chunks():
+            stop = start + len(addresses)
+            columns = [zip([OP_CODES[op] for op in ops.tolist()], addresses.tolist())]
+            if next_use is not None:
+                columns.append(next_use[start:stop].tolist())
+            for cache in caches:
+                index, tag = cache.decode_addresses(addresses)
+                columns.append(index.tolist())
+                columns.append(tag.tolist())
+            start = stop
+            yield from zip(*columns)
+
+    def next_use(self, block_size):
+        """
+        Computes, for every reference, the position of the next reference to the same block,
+        or len(self) if the block is never referenced again. Grouping the positions of each block
+        with a stable sort gives the same answer as a backward pass, without a Python level loop.
+        :return: An int64 array aligned with the trace
+        """
+        count = len(self)
+        blocks = np.asarray(self.addresses, dtype=np.uint32) >> int(math.log(block_size, 2))
+        order = np.argsort(blocks, kind='stable')
+        next_use = np.full(count, count, dtype=np.int64)
+        same_block = blocks[order[1:]] == blocks[order[:-1]]
+        next_use[order[:-1][same_block]] = order[1:][same_block]
+        return next_use
+
+    def write_next_use(self, block_size, path, chunk_size=NEXT_USE_CHUNK_SIZE):
+        """
+        Out-of-core form of next_use: one backward pass over the trace, a chunk at a time, writing
+        the next-use positions to an .npy file at path. Within a chunk the positions are grouped
+        like in next_use; the last reference of a block in a chunk takes the first position of
+        that block in the chunks after it, which is the only state kept between chunks.
+        Memory is bounded by the chunk size and the number of distinct blocks, not the trace length.
+        :return: The next-use array memory-mapped read-only from path
+        """
+        count = len(self)
+        offset_bits = int(math.log(block_size, 2))
+        next_use = np.lib.format.open_memmap(path, mode='w+', dtype=np.int64, shape=(count,))
+        first_position = {}  # block -> first position at which it is referenced in the chunks seen so far
+        for stop in range(count, 0, -chunk_size):
+            start = max(stop - chunk_size, 0)
+            blocks = np.asarray(self.addresses[start:stop], dtype=np.uint32) >> offset_bits
+            order = np.argsort(blocks, kind='stable')
+            sorted_blocks = blocks[order]
+            chunk_next_use = np.empty(stop - start, dtype=np.int64)
+            same_block = sorted_blocks[1:] == sorted_blocks[:-1]
+            chunk_next_use[order[:-1][same_block]] = order[1:][same_block] + start
+            # the last reference of each block in the chunk continues in a later chunk, if any
+            last = np.append(~same_block, True)
+            chunk_next_use[order[last]] = [first_position.get(block, count) for block in sorted_blocks[last].tolist()]
+            first = np.insert(~same_block, 0, True)
+            first_position.update(zip(sorted_blocks[first].tolist(), (order[first] + start).tolist()))
+            next_use[start:stop] = chunk_next_use
+        next_use.flush()
+        del next_use
+        return load_next_use(path)
+
+
+class TraceStream(Trace):
+    """
+    A text trace that is parsed while it is being simulated instead of being loaded first.
+    The source is read in large buffered blocks from a file, a .gz or .xz file or stdin ('-'),
+    so memory use stays flat whatever the length of the trace. It can only be traversed once
+    when reading from stdin, and its length is not known in advance.
+    """
+
+    def __init__(self, path, buffer_size=STREAM_BUFFER_SIZE):
+        self.path = path
+        self.buffer_size = buffer_size
+
+    def __len__(self):
+        raise TypeError("The length of a streamed trace is not known in advance")
+
+    def chunks(self, chunk_size=None):
+        """
+        :return: A generator over (ops, addresses) columns, one per block read from the source.
+        chunk_size is ignored, the chunks follow the buffer size.
+        """
+        f = open_trace_stream(self.path, self.buffer_size)
+        try:
+            tail = b""
+            block = f.read(self.buffer_size)
+            if block.startswith(UTF8_BOM):
+                block = block[len(UTF8_BOM):]
+            while block:
+                lines = (tail + block).split(b"\n")
+                tail = lines.pop()
+                ops, addresses = parse_lines(lines, self.path)
+                if len(addresses):
+                    yield ops, addresses
+                block = f.read(self.buffer_size)
+            ops, addresses = parse_lines([tail], self.path)
+            if len(addresses):
+                yield ops, addresses
+        finally:
+            if f is not sys.stdin.buffer:
+                f.close()
+
+
+def open_trace_stream(path, buffer_size=STREAM_BUFFER_SIZE):
+    """
+    Opens a trace for binary reading: '-' is stdin, .gz and .xz files are decompressed on the fly.
+    """
+    if path == '-':
+        return sys.stdin.buffer
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.xz'):
+        return lzma.open(path, 'rb')
+    return open(path, 'rb', buffering=buffer_size)
+
+
+def parse_lines(lines, path=""):
+    """
+    Parses lines of a text trace, each holding one "<r|w> <hex address>" reference.
+    Lines that do not have exactly two fields are skipped and any op other than 'r' is a write.
+    :return: ops and addresses numpy columns
+    """
+    ops = array.array('B')
+    addresses = array.array('I')
+    for x in lines:
+        inst = x.split()
+        if len(inst) == 2:
+            address = int(inst[1], base=16)
+            if address >> 32:
+                raise ValueError("Address {} in {} does not fit in 32 bits".format(inst[1].decode(), path))
+            ops.append(OP_READ if inst[0] == b'r' else OP_WRITE)
+            addresses.append(address)
+    return np.frombuffer(ops, dtype=np.uint8), np.frombuffer(addresses, dtype=np.uint32)
+
+
+def parse_tracefile(path):
+    """
+    Parses a whole text trace into memory.
+    :return: A Trace backed by in-memory numpy columns
+    """
+    with open(path, "rb") as f:
+        first_line = f.readline()
+        if first_line.startswith(UTF8_BOM):
+            first_line = first_line[len(UTF8_BOM):]
+        ops, addresses = parse_lines(itertools.chain([first_line], f), path)
+    return Trace(ops, addresses, path)
+
+
+def _addresses_offset(count):
+    return TRACE_HEADER.size + (count + 3) // 4 * 4
+
+
+def write_packed_trace(trace, path):
+    """
+    Writes the trace columns to path in the packed binary format.
+    The file is written next to its destination and renamed into place once complete.
+    """
+    count = len(trace)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, count))
+        f.write(np.ascontiguousarray(trace.ops, dtype=np.uint8).tobytes())
+        f.write(b"\0" * (_addresses_offset(count) - TRACE_HEADER.size - count))
+        f.write(np.ascontiguousarray(trace.addresses, dtype='<u4').tobytes())
+    os.replace(tmp_path, path)
+
+
+def convert_tracefile(src, dst=None):
+    """
+    Converts a text trace to the packed binary format.
+    :return: The path of the packed trace, <src without extension>.trc unless dst is given
+    """
+    if dst is None:
+        dst = os.path.splitext(src)[0] + PACKED_EXTENSION
+    write_packed_trace(parse_tracefile(src), dst)
+    return dst
+
+
+def is_packed_trace(path):
+    with open(path, "rb") as f:
+        return f.read(len(TRACE_MAGIC)) == TRACE_MAGIC
+
+
+def load_trace(path):
+    """
+    Memory-maps a packed trace. Nothing but the header is read until the columns are accessed.
+    :return: A Trace whose columns are read-only views of the file
+    """
+    with open(path, "rb") as f:
+        header = f.read(TRACE_HEADER.size)
+    if len(header) != TRACE_HEADER.size:
+        raise ValueError("{} is too short to be a packed trace".format(path))
+    magic, version, count = TRACE_HEADER.unpack(header)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError("{} is not a version {} packed trace".format(path, TRACE_VERSION))
+    if count == 0:
+        return Trace(np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint32), path)
+    ops = np.memmap(path, dtype=np.uint8, mode='r', offset=TRACE_HEADER.size, shape=(count,))
+    addresses = np.memmap(path, dtype='<u4', mode='r', offset=_addresses_offset(count), shape=(count,))
+    return Trace(ops, addresses, path)
+
+
+def read_trace(path):
+    """
+    Loads a trace in either format, memory-mapping it when it is packed.
+    """
+    if is_packed_trace(path):
+        return load_trace(path)
+    return parse_tracefile(path)
+
+
+def load_next_use(path):
+    """
+    Memory-maps a next-use array written by Trace.write_next_use.
+    """
+    return np.load(path, mmap_mode='r')
+
+
+def is_streamed_trace(path):
+    """
+    Traces from stdin or compressed files can only be read through a TraceStream.
+    """
+    return path == '-' or path.endswith('.gz') or path.endswith('.xz')
+
+
+if __name__ == "__main__":
+    # python Trace.py <trace_file> [<trace_file> ...]
+    for trace_file in sys.argv[1:]:
+        print(trace_file, "->", convert_tracefile(trace_file))
@@ -1,5 +1,15 @@
 import sys
-import Cache
+
+import Checkpoint
+import Instrument
+import MissClasses
+import Simulator
+
+USAGE = ("usage: python main.py <BLOCKSIZE> <L1_SIZE> <L1_ASSOC> <L2_SIZE> <L2_ASSOC> <REPLACEMENT_POLICY> "
+         "<INCLUSION_PROPERTY> <trace_file> [--stream] [--out-of-core] [--instrument] [--profile=FILE] "
+         "[--tracemalloc=FILE] [--classify-misses] [--checkpoint=FILE]")
+FLAGS = ('--stream', '--out-of-core', '--instrument', '--classify-misses')
+VALUE_FLAGS = ('--profile', '--tracemalloc', '--checkpoint')  # given as --name=value
 
 
 def configurator():
@@ -12,53 +22,73 @@ def configurator():
     :return: The configuration parameters
     """
     parameters = sys.argv
-    blocksize = int(parameters[1])
-    l1size = int(parameters[2])
-    l1assoc = int(parameters[3])
-    l2size = int(parameters[4])
-    l2assoc = int(parameters[5])
-    rep_pol = int(parameters[6])
-    inc_pol = int(parameters[7])
-    file = parameters[8]
+    try:
+        blocksize = int(parameters[1])
+        l1size = int(parameters[2])
+        l1assoc = int(parameters[3])
+        l2size = int(parameters[4])
+        l2assoc = int(parameters[5])
+        rep_pol = int(parameters[6])
+        inc_pol = int(parameters[7])
+        file = parameters[8]
+    except (IndexError, ValueError):
+        sys.exit(USAGE)
 
     return blocksize, l1size, l1assoc, l2size, l2assoc, rep_pol, inc_pol, file
 
 
-def read_tracefile(path):
-    f = open(path, "r", encoding='utf-8')
-    i = 0
-    for x in f:
-        inst = x.rstrip().split(' ')
-        if len(inst) == 2:
-            instruction_queue.append(inst)
+def get_options():
+    """
+    Optional flags following the trace file:
+    --stream       simulate while reading the trace instead of loading it first (LRU and PLRU only).
+                   Implied when the trace file is '-' (stdin) or a .gz/.xz file.
+    --out-of-core  keep the Optimal policy's next-use array in a temporary file instead of in memory.
+                   Combine with a packed trace to keep the trace itself out of memory too.
+    --instrument   time the decode, lookup, victim selection, lower level handoff and back-invalidation
+                   phases, count cache events and print a summary table after the results.
+    --profile=FILE         write a cProfile profile of the run to FILE.
+    --tracemalloc=FILE     write the peak memory and largest allocation sites of the run to FILE.
+    --classify-misses      split the misses of every level into compulsory, capacity and conflict misses,
+                           in total and per set, with a fully-associative LRU shadow of each cache.
+                           Not available with --checkpoint.
+    --checkpoint=FILE      save the state of the simulation to FILE as it goes, and resume from FILE
+                           if it already holds a checkpoint of the same configuration and trace.
+    Any other argument, and flags that cannot be combined, end the run with an error.
+    :return: The set of flags given
+    """
+    options = set(sys.argv[9:])
+    for option in options:
+        name, _, value = option.partition('=')
+        if not (option in FLAGS or name in VALUE_FLAGS and value):
+            sys.exit("Unknown or malformed option {}\n{}".format(option, USAGE))
+    return options
 
 
-def generate_future_dict(cache_l: Cache.Cache):
-    address_dict = {}
-    for ins in instruction_queue:
-        idx, tag = cache_l.get_instruction_components(ins[1])
-        if idx not in address_dict.keys():
-            address_dict[idx] = [tag]
-        else:
-            address_dict[idx].append(tag)
-    cache_l.future_table = address_dict
+def get_option_value(options, name):
+    """
+    :return: The value of a --name=value flag, or None if it was not given
+    """
+    for option in options:
+        if option.startswith(name + '='):
+            return option[len(name) + 1:]
+    return None
 
 
-def printResults(l1_obj, l2_obj):
-    rp_codes = ['LRU', 'Pseudo-LRU', 'Optimal']
-    ip_codes = ['non-inclusive', 'inclusive']
+def printResults(result, trace_file):
+    config = result.config
+    l1_obj, l2_obj = result.l1_cache, result.l2_cache
     print("===== Simulator configuration =====")
-    print("BLOCKSIZE: ", blocksize)
-    print("L1_SIZE: ", l1size)
-    print("L1_ASSOC: ", l1assoc)
-    print("L2_SIZE: ", l2size)
-    print("L2_ASSOC: ", l2assoc)
-    print("REPLACEMENT POLICY: ", rp_codes[rep_pol])
-    print("INCLUSION PROPERTY: ", ip_codes[inc_pol])
-    print("trace_file: ", file.split('/')[-1])
+    print("BLOCKSIZE: ", config.blocksize)
+    print("L1_SIZE: ", config.l1size)
+    print("L1_ASSOC: ", config.l1assoc)
+    print("L2_SIZE: ", config.l2size)
+    print("L2_ASSOC: ", config.l2assoc)
+    print("REPLACEMENT POLICY: ", Simulator.REPLACEMENT_POLICIES[config.rep_pol])
+    print("INCLUSION PROPERTY: ", Simulator.INCLUSION_PROPERTIES[config.inc_pol])
+    print("trace_file: ", trace_file.split('/')[-1])
     print("===== L1 contents =====")
     l1_obj.display_cache_content()
-    if l2size:
+    if config.l2size:
         print("===== L2 contents =====")
         l2_obj.display_cache_content()
     print("===== Simulation results (raw) =====")
@@ -74,88 +104,12 @@ def printResults(l1_obj, l2_obj):
     print("j. number of L2 write misses: ", l2_obj.measurements['writes_miss'])
     print("k. L2 miss rate: ", l2_obj.measurements['miss_rate'])
     print("l. number of L2 writebacks: ", l2_obj.measurements['num_writebacks'])
-    memory_traffic = l2_obj.measurements['memory_traffic'] if l2size else l1_obj.measurements['memory_traffic']
-    print("m. total memory traffic: ", memory_traffic)
-
-
-def run_PLRU():
-    plru_cache_l1 = Cache.PLRUCache(size=l1size, associativity=l1assoc, inclusion_property=inc_pol,
-                                    replacement_policy=rep_pol, block_size=blocksize, is_highest=True)
-
-    plru_cache_l2 = Cache.PLRUCache(size=l2size, associativity=l2assoc, inclusion_property=inc_pol,
-                                    replacement_policy=rep_pol, block_size=blocksize, is_highest=False)
-    for inst in instruction_queue:
-        status = plru_cache_l1.execute(inst)
-        if l2size:
-            if plru_cache_l1.is_write_back:
-                plru_cache_l2.execute(['w', plru_cache_l1.write_back_inst])
-            if status != 0:
-                plru_cache_l2.execute(['r', inst[1]])
-
-    plru_cache_l1.getMissRate(1)
-    plru_cache_l2.getMissRate(2)
-    plru_cache_l1.getMemoryTraffic(1, 0)
-    plru_cache_l2.getMemoryTraffic(2, 0)
-
-    printResults(plru_cache_l1, plru_cache_l2)
-
-
-def run_LRU():
-    l1_cache = Cache.Cache(size=l1size, associativity=l1assoc, inclusion_property=inc_pol,
-                           replacement_policy=rep_pol, block_size=blocksize, is_highest=True)
-
-    l2_cache = Cache.Cache(size=l2size, associativity=l2assoc, inclusion_property=inc_pol,
-                           replacement_policy=rep_pol, block_size=blocksize, is_highest=False)
-
-    for inst in instruction_queue:
-        status = l1_cache.execute(inst)
-        if l2size:
-            if l1_cache.is_write_back:
-                l2_cache.execute(['w', l1_cache.write_back_inst])
-                if l2_cache.is_issue_invalidate:
-                    l1_cache.invalidate_block(l2_cache.invalidate_inst)
-                    l2_cache.clear_validation_flags()
-            if status != 0:
-                l2_cache.execute(['r', inst[1]])
-                if l2_cache.is_issue_invalidate:
-                    l1_cache.invalidate_block(l2_cache.invalidate_inst)
-                    l2_cache.clear_validation_flags()
-
-    l1_cache.getMissRate(1)
-    l2_cache.getMissRate(2)
-    l1_cache.getMemoryTraffic(1, 0)
-    l2_cache.getMemoryTraffic(2, l1_cache.measurements['direct_writeback'])
-
-    printResults(l1_cache, l2_cache)
-
-
-def run_OPT():
-    l1_cache = Cache.Cache(size=l1size, associativity=l1assoc, inclusion_property=inc_pol,
-                           replacement_policy=rep_pol, block_size=blocksize, is_highest=True)
-
-    l2_cache = Cache.Cache(size=l2size, associativity=l2assoc, inclusion_property=inc_pol,
-                           replacement_policy=rep_pol, block_size=blocksize, is_highest=False)
-
-    generate_future_dict(l1_cache)
-    for inst in instruction_queue:
-        status = l1_cache.execute(inst)
-        if l2size:
-            if l1_cache.is_write_back:
-                l2_cache.execute(['w', l1_cache.write_back_inst])
-            if status != 0:
-                l2_cache.execute(['r', inst[1]])
-
-    l1_cache.getMissRate(1)
-    l2_cache.getMissRate(2)
-    l1_cache.getMemoryTraffic(1, 0)
-    l2_cache.getMemoryTraffic(2, 0)
-
-    printResults(l1_cache, l2_cache)
+    print("m. total memory traffic: ", result.memory_traffic)
 
 
 def get_aat_and_area(htl1, htl2, al1, al2, l1, l2):
     aat = 0.0
-    if l2size == 0:
+    if l2.size == 0:
         aat = htl1 + l1.measurements['miss_rate'] * 100
     else:
         aat = htl1 + l1.measurements['miss_rate']*(htl2 + l2.measurements['miss_rate']*100)
@@ -163,17 +117,41 @@ def get_aat_and_area(htl1, htl2, al1, al2, l1, l2):
     return aat, area
 
 
-# =========== Runner block ============
-
-instruction_queue = []
-blocksize, l1size, l1assoc, l2size, l2assoc, rep_pol, inc_pol, file = configurator()
-read_tracefile(file)
-
-if rep_pol == 0:
-    run_LRU()
-elif rep_pol == 1:
-    run_PLRU()
-else:
-    run_OPT()
-
-# ===================================
+def main():
+    """
+    The command line front end of Simulator.simulate.
+    :return: NONE
+    """
+    blocksize, l1size, l1assoc, l2size, l2assoc, rep_pol, inc_pol, file = configurator()
+    config = Simulator.Config(blocksize, l1size, l1assoc, l2size, l2assoc, rep_pol, inc_pol)
+    options = get_options()
+    instrument = '--instrument' in options
+    capture = Instrument.Capture(get_option_value(options, '--profile'), get_option_value(options, '--tracemalloc'))
+    capture.start()
+    load_trace, report = Simulator.load_trace, printResults
+    if instrument:
+        Instrument.enable()
+        load_trace, report = Instrument.timed("load", load_trace), Instrument.timed("report", report)
+    checkpoint_file = get_option_value(options, '--checkpoint')
+    if checkpoint_file and '--classify-misses' in options:
+        sys.exit("--classify-misses is not available with --checkpoint")
+    try:
+        trace = load_trace(file, '--stream' in options)
+        if checkpoint_file:
+            result = Checkpoint.simulate_resumable(config, trace, checkpoint_file,
+                                                   out_of_core='--out-of-core' in options)
+        else:
+            result = Simulator.simulate(config, trace, out_of_core='--out-of-core' in options,
+                                        classify_misses='--classify-misses' in options)
+    except ValueError as error:
+        sys.exit(str(error))
+    report(result, file)
+    if result.miss_classifiers:
+        MissClasses.print_classification(result.miss_classifiers)
+    capture.stop()
+    if instrument:
+        Instrument.print_summary()
+
+
+if __name__ == "__main__":
+    main()